@@ -5,6 +5,7 @@ Telegram Bot для сбора лидов с анкетой и Google Sheets и
 """
 
 import asyncio
+import html
 import json
 import base64
 import urllib.parse
@@ -14,7 +15,6 @@ import os
 import sys
 import secrets
 import string
-import aiosqlite
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional
 
@@ -22,15 +22,35 @@ from typing import Dict, Any, Optional
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
 from aiogram import Bot, Dispatcher, F
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 
 from config import Config
-from google_sheets_manager import GoogleSheetsManager
+from database import Database
+from metrics import Gauge, HANDLER_LATENCY, HandlerLatencyMiddleware, MetricsServer
+from migrations import apply_migrations
+from profiling import SlowUpdateProfiler
+from rate_limiter import TelegramRateLimiter, low_priority
+from reminder_scheduler import ReminderScheduler
+from keyboards import SurveyKeyboards, build_keyboard
+from survey_graph import SurveyGraph
+from sharding import OrderedUpdateFeeder, ShardSupervisor, ignore_stop_signals, poll_updates, stop_signal_event
+from webhook_server import run_webhook
+from event_buffer import EventBuffer
+from fsm_storage import SQLiteStorage
+from google_sheets_manager import SHEET_HEADERS, GoogleSheetsManager
+from lead_export_queue import LeadExportQueue
+from lead_stats import LeadStats, lead_day
+from lead_store import LeadStore
+from funnel import START_EVENT, FunnelRollup
+from survey_steps import STEP_ANSWERED, STEP_SHOWN, SurveyStepAggregator
+from lead_notifier import MESSAGE_LIMIT, LeadNotifier, NotificationRenderer
 
 # Настройка логирования
 logging.basicConfig(
@@ -43,42 +63,65 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Общее подключение к bot.db (открывается в main())
+database = Database(Config.DB_PATH)
+
 # Инициализация бота и диспетчера
-bot = Bot(token=Config.BOT_TOKEN, parse_mode=ParseMode.HTML)
-storage = MemoryStorage()
+session = None
+if Config.TELEGRAM_API_URL:
+    session = AiohttpSession(api=TelegramAPIServer.from_base(Config.TELEGRAM_API_URL))
+bot = Bot(token=Config.BOT_TOKEN, parse_mode=ParseMode.HTML, session=session)
+
+# Все исходящие сообщения проходят через общий лимитер (глобальный и на чат)
+rate_limiter = TelegramRateLimiter()
+bot.session.middleware(rate_limiter)
+
+# Состояния анкет хранятся в bot.db и переживают перезапуск
+storage = SQLiteStorage(database)
 dp = Dispatcher(storage=storage)
 
+# Длительность каждого обработчика для метрик
+dp.message.middleware(HandlerLatencyMiddleware())
+dp.callback_query.middleware(HandlerLatencyMiddleware())
+
+# Замер каждого апдейта; стеки и профили медленных сохраняются в PROFILE_DIR
+SlowUpdateProfiler().setup(dp)
+
+# Буфер аналитических событий (пишется в таблицу events пачками)
+event_buffer = EventBuffer(database)
+
 # Инициализация Google Sheets менеджера
 sheets_manager = GoogleSheetsManager()
 
-# Словарь для хранения запланированных напоминаний
-reminder_tasks = {}
+# Очередь пакетной выгрузки лидов в Google Sheets (с локальным outbox в bot.db)
+lead_queue = LeadExportQueue(sheets_manager, database)
+
+# Счётчики лидов по дням для /stats (обновляются вместе с outbox)
+lead_stats = LeadStats(database)
+
+# Локальная копия лидов для /leads и /resend (без чтения Google Sheets)
+lead_store = LeadStore(database)
+LEADS_PAGE_SIZE = 5
+
+# Фоновые задачи (выгрузка лидов и т.п.), которые нужно дождаться при остановке
+background_tasks = set()
+
+def run_in_background(coro):
+    """Запускает корутину фоновой задачей, не блокируя обработку апдейта"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
 
 # Инициализация базы данных
 async def init_db():
-    """Инициализация базы данных для демо-уведомлений и предзаписей"""
-    db_path = "bot.db"
-    async with aiosqlite.connect(db_path) as db:
-        await db.execute("""CREATE TABLE IF NOT EXISTS events(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER, event TEXT, payload TEXT, ts TEXT
-        )""")
-        await db.execute("""CREATE TABLE IF NOT EXISTS prereg(
-            user_id INTEGER PRIMARY KEY,
-            code TEXT, tariff TEXT, valid_to TEXT, created_at TEXT
-        )""")
-        await db.execute("""CREATE TABLE IF NOT EXISTS settings(
-            key TEXT PRIMARY KEY, value TEXT
-        )""")
-        await db.commit()
-
-async def log_event(user_id: int, event: str, payload: str = ""):
-    """Логирование событий в базу данных"""
-    db_path = "bot.db"
-    async with aiosqlite.connect(db_path) as db:
-        await db.execute("INSERT INTO events(user_id,event,payload,ts) VALUES(?,?,?,?)",
-                         (user_id, event, payload, datetime.utcnow().isoformat()))
-        await db.commit()
+    """Инициализация базы данных: применяет миграции схемы bot.db"""
+    version = await apply_migrations(database)
+    logger.info(f"Версия схемы базы данных: {version}")
+
+def log_event(user_id: int, event: str, payload: str = ""):
+    """Логирование событий в базу данных (через буфер, без ожидания записи)"""
+    event_buffer.add(user_id, event, payload)
 
 def gen_code(n=6):
     """Генерация кода предзаписи"""
@@ -89,37 +132,35 @@ async def create_prereg(user_id: int, tariff: str = "Pro 2 990 ₽"):
     """Создание предзаписи пользователя"""
     code = gen_code()
     valid_to = (datetime.now().replace(day=1) + timedelta(days=31*6))  # ~6 мес
-    db_path = "bot.db"
-    async with aiosqlite.connect(db_path) as db:
-        # вставляем/обновляем
-        await db.execute("""
-            INSERT INTO prereg(user_id, code, tariff, valid_to, created_at)
-            VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET code=excluded.code, tariff=excluded.tariff, valid_to=excluded.valid_to
-        """, (user_id, code, tariff, valid_to.isoformat(), datetime.utcnow().isoformat()))
-        await db.commit()
-        # номер в очереди — по порядку создания
-        cur = await db.execute("SELECT COUNT(*) FROM prereg WHERE created_at <= (SELECT created_at FROM prereg WHERE user_id=?)", (user_id,))
-        place = (await cur.fetchone())[0]
+    # номер в очереди хранится в prereg.place и не меняется при повторном закреплении
+    place = await database.upsert_prereg(
+        user_id, code, tariff, valid_to.isoformat(), datetime.utcnow().isoformat()
+    )
     return code, valid_to, place
 
-def kb_fbs_demo():
-    """Клавиатура для FBS демо-уведомления"""
-    return InlineKeyboardMarkup(inline_keyboard=[[
-        InlineKeyboardButton(text="⏰ Отложить 15 мин", callback_data="demo:fbs:snooze15"),
-        InlineKeyboardButton(text="✅ Готово", callback_data="demo:fbs:done")
-    ],[
-        InlineKeyboardButton(text="📊 Сводка", callback_data="demo:summary")
-    ]])
-
-def kb_fbo_demo():
-    """Клавиатура для FBO демо-уведомления"""
-    return InlineKeyboardMarkup(inline_keyboard=[[
-        InlineKeyboardButton(text="📅 Изменить слот", callback_data="demo:fbo:slot"),
-        InlineKeyboardButton(text="🌅 Напомнить утром", callback_data="demo:fbo:morning")
-    ],[
-        InlineKeyboardButton(text="📊 Сводка", callback_data="demo:summary")
-    ]])
+# Ошибки editMessageText, после которых вопрос показывается новым сообщением
+UNEDITABLE_MESSAGE_ERRORS = (
+    "message can't be edited",
+    "message to edit not found",
+    "there is no text in the message to edit",
+)
+
+# Статические клавиатуры создаются один раз: объекты aiogram неизменяемые
+KB_FBS_DEMO = build_keyboard([
+    [("⏰ Отложить 15 мин", "demo:fbs:snooze15"), ("✅ Готово", "demo:fbs:done")],
+    [("📊 Сводка", "demo:summary")],
+])
+
+KB_FBO_DEMO = build_keyboard([
+    [("📅 Изменить слот", "demo:fbo:slot"), ("🌅 Напомнить утром", "demo:fbo:morning")],
+    [("📊 Сводка", "demo:summary")],
+])
+
+KB_PRICING = build_keyboard([
+    [("🔒 Закрепить предзапись", "prereg:lock")],
+    [("🎯 Показать демо", "demo:open")],
+    [("💳 Мой код цены", "my_price")],
+])
 
 async def send_demo_notifications(msg: Message):
     """Отправка демо-уведомлений"""
@@ -127,13 +168,13 @@ async def send_demo_notifications(msg: Message):
         "🔔 Заказ #308132 — дедлайн через 1 ч 20 мин\n"
         "FBS · ПВЗ: Москва, Ленина 10 · приоритет: важно\n\n"
         "Что сделать:\n— Проверьте сборку и маркировку\n— Подтвердите курьера/самовывоз\n— Не откладывайте: после дедлайна рейтинг и отмены",
-        reply_markup=kb_fbs_demo()
+        reply_markup=KB_FBS_DEMO
     )
     await msg.answer(
         "⏰ Поставка FBO — до «красной зоны» 24 ч\n"
         "Риск удержания: min(5 ₽ × ед., 25 000 ₽)\n\n"
         "Что сделать:\n— Уточните слот (переносите не позднее, чем за 72 ч)\n— Проверьте упаковку, габариты и паллеты\n— Назначьте ответственного",
-        reply_markup=kb_fbo_demo()
+        reply_markup=KB_FBO_DEMO
     )
 
 async def send_demo_notifications_with_intro(msg: Message):
@@ -193,47 +234,37 @@ async def show_pricing(msg: Message):
 Без подключений и настроек — сразу увидите результат!
 """
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔒 Закрепить предзапись", callback_data="prereg:lock")],
-        [InlineKeyboardButton(text="🎯 Показать демо", callback_data="demo:open")],
-        [InlineKeyboardButton(text="💳 Мой код цены", callback_data="my_price")]
-    ])
-    
-    await msg.answer(pricing_text, reply_markup=keyboard, parse_mode='HTML')
+    await msg.answer(pricing_text, reply_markup=KB_PRICING, parse_mode='HTML')
 
 async def send_reminder(user_id: int):
     """Отправляет напоминание о прохождении анкеты"""
     try:
-        await bot.send_message(
-            user_id,
-            "🔔 Напоминание! Не забудьте пройти анкету для получения персонального предложения.\n\n"
-            "Нажмите /start чтобы начать заполнение анкеты.",
-            parse_mode='HTML'
-        )
+        with low_priority():
+            await bot.send_message(
+                user_id,
+                "🔔 Напоминание! Не забудьте пройти анкету для получения персонального предложения.\n\n"
+                "Нажмите /start чтобы начать заполнение анкеты.",
+                parse_mode='HTML'
+            )
         logger.info(f"Отправлено напоминание пользователю {user_id}")
     except Exception as e:
         logger.error(f"Ошибка отправки напоминания пользователю {user_id}: {e}")
 
 async def schedule_reminder(user_id: int, delay_hours: int = 24):
     """Планирует отправку напоминания через указанное количество часов"""
-    delay_seconds = delay_hours * 3600
-    
-    async def reminder_task():
-        await asyncio.sleep(delay_seconds)
-        await send_reminder(user_id)
-        # Удаляем задачу из словаря после выполнения
-        if user_id in reminder_tasks:
-            del reminder_tasks[user_id]
-    
-    # Отменяем предыдущее напоминание, если оно есть
-    if user_id in reminder_tasks:
-        reminder_tasks[user_id].cancel()
-    
-    # Создаем новую задачу
-    task = asyncio.create_task(reminder_task())
-    reminder_tasks[user_id] = task
+    await reminder_scheduler.schedule(user_id, delay_hours * 3600)
     logger.info(f"Запланировано напоминание для пользователя {user_id} через {delay_hours} часов")
 
+# Планировщик напоминаний (хранит их в bot.db и переживает перезапуск)
+reminder_scheduler = ReminderScheduler(database, send_reminder)
+
+# Метрики состояния, вычисляемые при запросе /metrics
+Gauge('bot_reminders_pending', 'Scheduled reminders in bot.db', reminder_scheduler.pending_count)
+Gauge('bot_fsm_sessions', 'Active FSM sessions in bot.db', storage.count_sessions)
+Gauge('bot_fsm_sessions_cached', 'FSM sessions in the in-memory cache', lambda: storage.cached_sessions)
+Gauge('bot_send_queue_depth', 'Outgoing messages waiting for a global send token', lambda: rate_limiter.queue_depth)
+metrics_server = MetricsServer()
+
 # Состояния FSM для анкеты
 class SurveyStates(StatesGroup):
     waiting_for_start = State()
@@ -279,6 +310,7 @@ SURVEY_CONFIG = {
             "id": "volume_fbs",
             "question": "FBS заказы в месяц (примерно):",
             "type": "single",
+            "skip_if": {"work_type": ["На склад МП (FBO/FBW)"]},
             "options": [
                 "0-50",
                 "50-200",
@@ -291,6 +323,7 @@ SURVEY_CONFIG = {
             "id": "volume_fbo",
             "question": "FBO/FBW поставки в месяц (примерно):",
             "type": "single",
+            "skip_if": {"work_type": ["Со склада продавца (FBS)"]},
             "options": [
                 "0-2",
                 "3-6",
@@ -416,28 +449,15 @@ class SurveyHandler:
     
     def __init__(self):
         self.config = SURVEY_CONFIG
+        self.graph = SurveyGraph(SURVEY_CONFIG)
+        self.keyboards = SurveyKeyboards(SURVEY_CONFIG)
     
     def create_keyboard(self, question: Dict[str, Any], user_answers: Dict[str, Any] = None) -> InlineKeyboardMarkup:
-        """Создает клавиатуру для вопроса"""
-        keyboard = []
-        
-        for i, option in enumerate(question['options']):
-            # Для множественного выбора показываем статус выбора
-            if question['type'] == 'multi':
-                is_selected = user_answers and option in user_answers.get(question['id'], [])
-                text = f"{'✅' if is_selected else '⬜'} {option}"
-            else:
-                text = option
-            
-            # Используем индекс вместо полного текста для избежания проблем с символами
-            callback_data = f"answer:{question['id']}:{i}"
-            keyboard.append([InlineKeyboardButton(text=text, callback_data=callback_data)])
-        
-        # Кнопка "Далее" для множественного выбора
-        if question['type'] == 'multi':
-            keyboard.append([InlineKeyboardButton(text="➡️ Далее", callback_data=f"next:{question['id']}")])
-        
-        return InlineKeyboardMarkup(inline_keyboard=keyboard)
+        """Возвращает клавиатуру для вопроса из предсобранных"""
+        selected_mask = 0
+        if question['type'] == 'multi' and user_answers and question['id'] in user_answers:
+            selected_mask = self.graph.get(question['id']).mask(user_answers[question['id']])
+        return self.keyboards.question(question, selected_mask)
     
     async def start_survey(self, message: Message, state: FSMContext, utm_data: Dict[str, str] = None):
         """Начинает анкету"""
@@ -450,29 +470,51 @@ class SurveyHandler:
             utm_data=utm_data or {},
             answers={}
         )
+        log_event(message.from_user.id, START_EVENT, json.dumps(utm_data or {}, ensure_ascii=False))
         
         # Показываем приветственное сообщение
         welcome_text = f"{self.config['welcome']['title']}"
-        keyboard = [[InlineKeyboardButton(text=btn, callback_data=f"welcome:{i}")] for i, btn in enumerate(self.config['welcome']['buttons'])]
         await message.answer(
             welcome_text,
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
+            reply_markup=self.keyboards.welcome,
             parse_mode='Markdown'
         )
     
-    async def show_question(self, message: Message, state: FSMContext, question_index: int = 0):
-        """Показывает вопрос анкеты"""
-        if question_index >= len(self.config['questions']):
+    async def show_question(self, message: Message, state: FSMContext, question_index: int = 0, edit: bool = False):
+        """Показывает вопрос анкеты.
+        
+        edit=True — message является сообщением бота с предыдущим шагом анкеты; при
+        SURVEY_EDIT_IN_PLACE вопрос показывается в нём же вместо нового сообщения.
+        """
+        if question_index >= len(self.graph):
             # Анкета завершена
             await self.complete_survey(message, state)
             return
         
-        question = self.config['questions'][question_index]
+        question = self.graph.nodes[question_index].question
         data = await state.get_data()
         user_answers = data.get('answers', {})
         
         keyboard = self.create_keyboard(question, user_answers)
-        await message.answer(question['question'], reply_markup=keyboard)
+        shown = False
+        if edit and Config.SURVEY_EDIT_IN_PLACE:
+            try:
+                await message.edit_text(question['question'], reply_markup=keyboard)
+                shown = True
+            except TelegramBadRequest as e:
+                error = e.message.lower()
+                if 'message is not modified' in error:
+                    # Повторное нажатие той же кнопки: вопрос уже на экране и уже учтён
+                    return
+                if not any(reason in error for reason in UNEDITABLE_MESSAGE_ERRORS):
+                    raise
+                # Сообщение удалено, слишком старое или без текста — показываем вопрос новым сообщением
+                logger.warning(f"Не удалось обновить сообщение анкеты: {e}")
+        if not shown:
+            await message.answer(question['question'], reply_markup=keyboard)
+        # Показ учитываем только после успешной отправки: иначе не показанный вопрос попал бы в отсев.
+        # В личном чате id чата совпадает с id пользователя (message может быть сообщением бота)
+        log_event(data.get('user_id', message.chat.id), STEP_SHOWN, question['id'])
     
     async def handle_answer(self, callback: CallbackQuery, state: FSMContext):
         """Обрабатывает ответ на вопрос"""
@@ -483,27 +525,22 @@ class SurveyHandler:
         answers = data.get('answers', {})
         
         # Обрабатываем ответ в зависимости от типа вопроса
-        question = next((q for q in self.config['questions'] if q['id'] == question_id), None)
-        if not question:
+        node = self.graph.get(question_id)
+        if not node:
             await callback.answer("Ошибка: вопрос не найден")
             return
+        question = node.question
         
-        # Получаем текст ответа по индексу
-        if 0 <= option_index < len(question['options']):
-            answer_text = question['options'][option_index]
-        else:
+        # Ответы храним индексами, текст нужен только при выгрузке
+        if not 0 <= option_index < len(question['options']):
             await callback.answer("Ошибка: неверный индекс ответа")
             return
         
         if question['type'] == 'multi':
-            # Множественный выбор
-            if question_id not in answers:
-                answers[question_id] = []
-            
-            if answer_text in answers[question_id]:
-                answers[question_id].remove(answer_text)
-            else:
-                answers[question_id].append(answer_text)
+            # Множественный выбор: переключаем бит варианта в маске
+            answers[question_id] = node.mask(answers.get(question_id, 0)) ^ (1 << option_index)
+            data['answers'] = answers
+            await state.set_data(data)
             
             # Обновляем клавиатуру
             keyboard = self.create_keyboard(question, answers)
@@ -512,9 +549,10 @@ class SurveyHandler:
             
         else:
             # Одиночный выбор
-            answers[question_id] = answer_text
+            answers[question_id] = option_index
             data['answers'] = answers
             await state.set_data(data)
+            log_event(callback.from_user.id, STEP_ANSWERED, question_id)
             
             await callback.answer()
             await self.show_next_question(callback.message, state, question_id)
@@ -531,20 +569,23 @@ class SurveyHandler:
             await callback.answer("Пожалуйста, выберите хотя бы один вариант")
             return
         
+        log_event(callback.from_user.id, STEP_ANSWERED, question_id)
         await callback.answer()
         await self.show_next_question(callback.message, state, question_id)
     
     async def show_next_question(self, message: Message, state: FSMContext, current_question_id: str):
         """Показывает следующий вопрос"""
-        current_index = next((i for i, q in enumerate(self.config['questions']) if q['id'] == current_question_id), -1)
-        next_index = current_index + 1
+        data = await state.get_data()
+        # Вопросы, не относящиеся к пользователю по предыдущим ответам, пропускаются
+        next_node = self.graph.next_after(current_question_id, data.get('answers', {}))
         
-        if next_index < len(self.config['questions']):
-            await self.show_question(message, state, next_index)
+        if next_node is not None:
+            await self.show_question(message, state, next_node.index, edit=True)
         else:
             # Анкета завершена
             await self.complete_survey(message, state)
     
+    @HANDLER_LATENCY.timed(handler='complete_survey')
     async def complete_survey(self, message: Message, state: FSMContext):
         """Завершает анкету и сохраняет данные"""
         data = await state.get_data()
@@ -552,11 +593,14 @@ class SurveyHandler:
         
         logger.info(f"Завершение анкеты для пользователя {data['user_id']}")
         
-        # Сохраняем в Google Sheets
-        success = await sheets_manager.save_lead(data)
-        
-        # Отправляем уведомление в приватный канал
-        await self.send_notification(data, success)
+        # Лид сначала попадает в локальный outbox, выгрузка в Google Sheets и
+        # уведомление канала идут в фоне — пользователь не ждёт ответа API
+        try:
+            export_result = await lead_queue.put(data)
+            run_in_background(self.notify_when_exported(data, export_result))
+        except Exception as e:
+            logger.error(f"Ошибка сохранения лида в outbox: {e}")
+            run_in_background(self.send_notification(data, False))
         
         # Отправляем демо-уведомления
         await send_demo_notifications_with_intro(message)
@@ -566,72 +610,34 @@ class SurveyHandler:
         
         # Отправляем финальное сообщение с кнопками
         final_text = f"**{self.config['final']['title']}**\n\n{self.config['final']['description']}"
-        keyboard = [[InlineKeyboardButton(text=btn, callback_data=f"final:{i}")] for i, btn in enumerate(self.config['final']['buttons'])]
         await message.answer(
             final_text,
-            reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
+            reply_markup=self.keyboards.final,
             parse_mode='Markdown'
         )
         
         # Очищаем состояние
         await state.clear()
     
+    async def notify_when_exported(self, data: Dict[str, Any], export_result: asyncio.Future):
+        """Дожидается первой попытки выгрузки лида и отправляет уведомление в приватный канал"""
+        success = await export_result
+        await self.send_notification(data, success)
+    
     async def send_notification(self, data: Dict[str, Any], sheets_success: bool):
-        """Отправляет уведомление в приватный канал"""
-        try:
-            # Проверяем, что PRIVATE_CHANNEL_ID настроен
-            if not Config.PRIVATE_CHANNEL_ID:
-                logger.warning("PRIVATE_CHANNEL_ID не настроен. Уведомление не отправлено.")
-                return
-                
-            # Форматируем время для читаемости
-            try:
-                complete_time = datetime.fromisoformat(data['tg_complete']).strftime('%d.%m.%Y %H:%M:%S')
-            except:
-                complete_time = data['tg_complete']
-                
-            notification_text = f"""
-🎉 <b>Новый лид заполнил анкету!</b>
-
-📋 <b>Lead ID:</b> <code>{data['lead_id']}</code>
-👤 <b>Пользователь:</b> @{data['username']} (ID: {data['user_id']})
-📅 <b>Время заполнения:</b> {complete_time}
-💾 <b>Google Sheets:</b> {'✅ Сохранено' if sheets_success else '❌ Ошибка'}
-
-📊 <b>Ответы:</b>
-"""
-            
-            for question in self.config['questions']:
-                question_id = question['id']
-                answer = data['answers'].get(question_id, 'Не указано')
-                
-                if isinstance(answer, list):
-                    answer = ', '.join(answer) if answer else 'Не указано'
-                
-                notification_text += f"• <b>{question['question']}</b>: {answer}\n"
-            
-            # Добавляем UTM-параметры
-            utm_data = data.get('utm_data', {})
-            if utm_data:
-                notification_text += "\n🏷 <b>UTM-параметры:</b>\n"
-                for key, value in utm_data.items():
-                    notification_text += f"• <b>{key}:</b> {value}\n"
-            
-            # Добавляем подробную информацию о статусе Google Sheets
-            if sheets_success:
-                notification_text += "\n✅ <b>Данные успешно загружены в Google Sheets!</b>"
-            else:
-                notification_text += "\n❌ <b>Ошибка при загрузке в Google Sheets!</b>"
-            
-            await bot.send_message(Config.PRIVATE_CHANNEL_ID, notification_text, parse_mode='HTML')
-            logger.info(f"Уведомление отправлено в канал {Config.PRIVATE_CHANNEL_ID}")
-            
-        except Exception as e:
-            logger.error(f"Ошибка отправки уведомления: {e}")
-            logger.error(f"Детали ошибки: {type(e).__name__}")
+        """Отправляет уведомление в приватный канал (при всплеске лидов — в составе сводки)"""
+        await lead_notifier.notify(data, sheets_success)
 
 # Создаем экземпляр обработчика анкеты
 survey_handler = SurveyHandler()
+sheets_manager.survey_graph = survey_handler.graph
+# Воронка по UTM: запуски — из пачек событий, завершения и ответы — вместе с лидом
+funnel_rollup = FunnelRollup(survey_handler.graph)
+event_buffer.aggregators.append(funnel_rollup)
+lead_queue.funnel = funnel_rollup
+# Шаги анкеты: показы, ответы и время на вопрос по событиям show_question и ответов
+event_buffer.aggregators.append(SurveyStepAggregator())
+lead_notifier = LeadNotifier(bot, NotificationRenderer(survey_handler.graph))
 
 # Обработчики команд
 @dp.message(CommandStart())
@@ -655,10 +661,7 @@ async def cmd_restart(message: Message, state: FSMContext):
 async def my_price(msg: Message):
     """Показать код цены пользователя"""
     try:
-        db_path = "bot.db"
-        async with aiosqlite.connect(db_path) as db:
-            cur = await db.execute("SELECT code, tariff, valid_to FROM prereg WHERE user_id=?", (msg.from_user.id,))
-            row = await cur.fetchone()
+        row = await database.get_prereg(msg.from_user.id)
         
         if not row:
             await msg.answer("❌ Предзапись не найдена\n💡 Используйте /prereg для создания предзаписи")
@@ -707,7 +710,7 @@ async def cmd_prereg(msg: Message):
     """Создать предзапись"""
     try:
         code, valid_to, place = await create_prereg(msg.from_user.id)
-        await log_event(msg.from_user.id, "prereg_lock", code)
+        log_event(msg.from_user.id, "prereg_lock", code)
         await msg.answer(
             f"✅ Предзапись закреплена!\n"
             f"Код цены: <b>{code}</b>\n"
@@ -720,6 +723,160 @@ async def cmd_prereg(msg: Message):
         await msg.answer("❌ Ошибка создания предзаписи. Попробуйте позже.")
         logger.error(f"Ошибка создания предзаписи: {e}")
 
+@dp.message(Command("stats"))
+async def cmd_stats(msg: Message):
+    """Статистика лидов для администраторов; /stats sync — сверка с Google Sheets"""
+    if msg.from_user.id not in Config.ADMIN_USER_IDS:
+        await msg.answer("❌ У вас нет доступа к этой команде.")
+        return
+    
+    try:
+        args = msg.text.split()[1:]
+        if args and args[0] == 'sync':
+            if not sheets_manager.enabled:
+                await msg.answer("❌ Google Sheets отключен. Сверка недоступна.")
+                return
+            result = await lead_stats.reconcile(sheets_manager)
+            await msg.answer(f"🔄 Статистика сверена с Google Sheets: было {result['before']}, стало {result['after']}")
+        
+        stats = await lead_stats.get()
+        await msg.answer(
+            f"📊 <b>Статистика лидов</b>\n\n"
+            f"📈 Всего лидов: {stats['total_leads']}\n"
+            f"📅 Лидов за сегодня: {stats['today_leads']}",
+            parse_mode='HTML'
+        )
+    except Exception as e:
+        await msg.answer("❌ Ошибка при получении статистики.")
+        logger.error(f"Ошибка получения статистики: {e}")
+
+def format_lead(record: Dict[str, Any]) -> str:
+    """Лид для админских команд: строка таблицы с подписями столбцов"""
+    row = record['row']
+    lines = [f"🔸 <b>Лид</b> <code>{html.escape(str(record['lead_id']))}</code>"]
+    for header, value in zip(SHEET_HEADERS[1:], row[1:]):
+        if value not in ('', None, 'Не указано'):
+            lines.append(f"   {html.escape(header)}: {html.escape(str(value))}")
+    return '\n'.join(lines)
+
+def parse_leads_filters(args) -> Dict[str, Optional[str]]:
+    """Фильтры /leads: source=<utm_source>, date=<ГГГГ-ММ-ДД>, before=<lead_id>"""
+    filters = {'source': None, 'date': None, 'before': None}
+    for arg in args:
+        key, _, value = arg.partition('=')
+        if key not in filters or not value:
+            raise ValueError(arg)
+        if key == 'date':
+            value = lead_day(value)
+            if value is None:
+                raise ValueError(arg)
+        filters[key] = value
+    return filters
+
+async def render_leads_page(before_id: Optional[int], source: Optional[str], day: Optional[str]):
+    """Страница последних лидов и клавиатура перехода к более старым"""
+    records = await lead_store.recent(LEADS_PAGE_SIZE + 1, before_id, source, day)
+    if not records:
+        return "📋 Лидов не найдено.", None
+    
+    title = "📋 <b>Последние лиды</b>"
+    if source or day:
+        title += f" ({', '.join(html.escape(value) for value in (source, day) if value)})"
+    text = title
+    shown = 0
+    for record in records[:LEADS_PAGE_SIZE]:
+        block = format_lead(record)
+        # Страница укорачивается, если лиды не помещаются в одно сообщение
+        if shown and len(text) + len(block) + 2 > MESSAGE_LIMIT - 100:
+            break
+        text += "\n\n" + block
+        shown += 1
+    
+    keyboard = None
+    if len(records) > shown:
+        callback_data = f"leads:{records[shown - 1]['id']}:{day or ''}:{source or ''}"
+        # callback_data ограничена 64 байтами: с длинным utm_source листаем командой
+        if len(callback_data.encode('utf-8')) <= 64:
+            keyboard = build_keyboard([[("⬅️ Более ранние", callback_data)]])
+        else:
+            text += f"\n\nДальше: /leads before={html.escape(records[shown - 1]['lead_id'])}"
+    return text, keyboard
+
+@dp.message(Command("leads"))
+async def cmd_leads(msg: Message):
+    """Последние лиды для администраторов: /leads [source=vk] [date=2025-01-31] [before=<lead_id>]"""
+    if msg.from_user.id not in Config.ADMIN_USER_IDS:
+        await msg.answer("❌ У вас нет доступа к этой команде.")
+        return
+    
+    try:
+        filters = parse_leads_filters(msg.text.split()[1:])
+    except ValueError as e:
+        await msg.answer(f"❌ Неизвестный фильтр: {html.escape(str(e))}\n"
+                         f"Формат: /leads source=vk date=2025-01-31 before=&lt;lead_id&gt;")
+        return
+    
+    try:
+        before_id = None
+        if filters['before']:
+            record = await lead_store.get(filters['before'])
+            if not record:
+                await msg.answer("❌ Лид не найден.")
+                return
+            before_id = record['id']
+        text, keyboard = await render_leads_page(before_id, filters['source'], filters['date'])
+        await msg.answer(text, reply_markup=keyboard, parse_mode='HTML')
+    except Exception as e:
+        await msg.answer("❌ Ошибка при получении лидов.")
+        logger.error(f"Ошибка получения лидов: {e}")
+
+@dp.message(Command("resend"))
+async def cmd_resend(msg: Message):
+    """Переотправка лида в приватный канал: /resend [lead_id], по умолчанию последний"""
+    if msg.from_user.id not in Config.ADMIN_USER_IDS:
+        await msg.answer("❌ У вас нет доступа к этой команде.")
+        return
+    
+    if not Config.PRIVATE_CHANNEL_ID:
+        await msg.answer("❌ PRIVATE_CHANNEL_ID не настроен.")
+        return
+    
+    try:
+        args = msg.text.split()[1:]
+        if args:
+            record = await lead_store.get(args[0])
+        else:
+            records = await lead_store.recent(1)
+            record = records[0] if records else None
+        if not record:
+            await msg.answer("📋 Данных для переотправки нет.")
+            return
+        
+        with low_priority():
+            await bot.send_message(Config.PRIVATE_CHANNEL_ID, "🔄 <b>Переотправка лида</b>\n\n" + format_lead(record),
+                                   parse_mode='HTML')
+        await msg.answer("✅ Лид переотправлен в приватный канал.")
+    except Exception as e:
+        await msg.answer("❌ Ошибка при переотправке лида.")
+        logger.error(f"Ошибка переотправки лида: {e}")
+
+@dp.message(Command("requeue"))
+async def cmd_requeue(msg: Message):
+    """Возвращает в очередь выгрузки лиды, отклонённые Google Sheets"""
+    if msg.from_user.id not in Config.ADMIN_USER_IDS:
+        await msg.answer("❌ У вас нет доступа к этой команде.")
+        return
+    
+    try:
+        requeued = await lead_queue.requeue_failed()
+        if requeued:
+            await msg.answer(f"🔄 Возвращено в очередь выгрузки лидов: {requeued}")
+        else:
+            await msg.answer("📋 Отклонённых лидов нет.")
+    except Exception as e:
+        await msg.answer("❌ Ошибка при возврате лидов в очередь.")
+        logger.error(f"Ошибка возврата лидов в очередь: {e}")
+
 @dp.message(Command("help"))
 async def cmd_help(msg: Message):
     """Показать справку по командам"""
@@ -755,7 +912,7 @@ async def handle_welcome_buttons(callback: CallbackQuery, state: FSMContext):
     
     if button_index == 0:  # "Начать анкету"
         await callback.answer()
-        await survey_handler.show_question(callback.message, state, 0)
+        await survey_handler.show_question(callback.message, state, 0, edit=True)
     else:  # "Позже"
         await callback.answer("Хорошо, возвращайтесь когда будете готовы! 👋")
         await callback.message.edit_text("Хорошо, возвращайтесь когда будете готовы! 👋")
@@ -781,8 +938,14 @@ async def handle_final_buttons(callback: CallbackQuery, state: FSMContext):
     button_index = int(button_index)
     
     if button_index == 0:  # "Закрепить предзапись в приоритет и быть первым кто испробует"
-        code, valid_to, place = await create_prereg(callback.from_user.id)
-        await log_event(callback.from_user.id, "prereg_lock", code)
+        try:
+            code, valid_to, place = await create_prereg(callback.from_user.id)
+        except Exception as e:
+            logger.error(f"Ошибка создания предзаписи: {e}")
+            await callback.answer()
+            await callback.message.answer("❌ Ошибка создания предзаписи. Попробуйте позже.")
+            return
+        log_event(callback.from_user.id, "prereg_lock", code)
         await callback.message.answer(
             f"✅ Готово! Вы в приоритете.\n"
             f"Код цены: <b>{code}</b>\n"
@@ -801,7 +964,7 @@ async def handle_final_buttons(callback: CallbackQuery, state: FSMContext):
 @dp.callback_query(F.data.startswith("demo:"))
 async def handle_demo_buttons(callback: CallbackQuery):
     """Обработчик демо-кнопок"""
-    await log_event(callback.from_user.id, "demo_click", callback.data)
+    log_event(callback.from_user.id, "demo_click", callback.data)
     
     if callback.data == "demo:fbs:snooze15":
         await callback.answer("⏰ Напомню через 15 минут")
@@ -825,7 +988,7 @@ async def handle_demo_buttons(callback: CallbackQuery):
 @dp.callback_query(F.data.startswith("nav:"))
 async def handle_nav_buttons(callback: CallbackQuery):
     """Обработчик навигационных кнопок"""
-    await log_event(callback.from_user.id, "nav_click", callback.data)
+    log_event(callback.from_user.id, "nav_click", callback.data)
     
     if callback.data == "nav:pricing":
         await callback.answer("💰 Показываю тарифы")
@@ -834,7 +997,7 @@ async def handle_nav_buttons(callback: CallbackQuery):
 @dp.callback_query(F.data.startswith("prereg:"))
 async def handle_prereg_buttons(callback: CallbackQuery):
     """Обработчик кнопок предзаписи"""
-    await log_event(callback.from_user.id, "prereg_click", callback.data)
+    log_event(callback.from_user.id, "prereg_click", callback.data)
     
     if callback.data == "prereg:lock":
         await callback.answer("🔒 Создаю предзапись...")
@@ -852,16 +1015,25 @@ async def handle_prereg_buttons(callback: CallbackQuery):
             await callback.message.answer("❌ Ошибка создания предзаписи. Попробуйте позже.")
             logger.error(f"Ошибка создания предзаписи: {e}")
 
+@dp.callback_query(F.data.startswith("leads:"))
+async def handle_leads_page(callback: CallbackQuery):
+    """Переход к более ранним лидам в /leads"""
+    if callback.from_user.id not in Config.ADMIN_USER_IDS:
+        await callback.answer("❌ Нет доступа")
+        return
+    
+    _, before_id, day, source = callback.data.split(':', 3)
+    text, keyboard = await render_leads_page(int(before_id), source or None, day or None)
+    await callback.answer()
+    await callback.message.answer(text, reply_markup=keyboard, parse_mode='HTML')
+
 @dp.callback_query(F.data == "my_price")
 async def handle_my_price_button(callback: CallbackQuery):
     """Обработчик кнопки 'Мой код цены'"""
-    await log_event(callback.from_user.id, "my_price_click", "button")
+    log_event(callback.from_user.id, "my_price_click", "button")
     
     try:
-        db_path = "bot.db"
-        async with aiosqlite.connect(db_path) as db:
-            cur = await db.execute("SELECT code, tariff, valid_to FROM prereg WHERE user_id=?", (callback.from_user.id,))
-            row = await cur.fetchone()
+        row = await database.get_prereg(callback.from_user.id)
         
         if not row:
             await callback.answer("❌ Предзапись не найдена")
@@ -889,32 +1061,122 @@ async def handle_unknown(message: Message):
     """Обработчик неизвестных сообщений"""
     await message.answer("👋 Привет! Нажмите /start чтобы начать заполнение анкеты или /help для справки по командам.")
 
+async def start_services():
+    """Подключает базу данных и запускает фоновые задачи"""
+    # Открываем общее подключение и инициализируем базу данных
+    await database.connect()
+    await init_db()
+    logger.info("База данных инициализирована")
+    
+    # Запускаем очистку FSM-сессий, запись событий, очередь выгрузки лидов и напоминания
+    await metrics_server.start()
+    await storage.start()
+    await event_buffer.start()
+    await lead_queue.start()
+    await lead_notifier.start()
+    await reminder_scheduler.start()
+
+async def stop_services():
+    """Останавливает фоновые задачи и закрывает подключения"""
+    await metrics_server.stop()
+    await storage.close()
+    await reminder_scheduler.stop()
+    # Выгружаем лиды, оставшиеся в outbox, и дожидаемся уведомлений
+    await lead_queue.stop()
+    if background_tasks:
+        logger.info(f"Ожидаем завершения фоновых задач: {len(background_tasks)}")
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+    await lead_notifier.stop()
+    sheets_manager.shutdown()
+    await event_buffer.stop()
+    await database.close()
+    await bot.session.close()
+
+def run_worker(index: int, count: int, queue):
+    """Точка входа процесса-воркера в режиме шардирования"""
+    ignore_stop_signals()
+    asyncio.run(worker_main(index, count, queue))
+
+async def worker_main(index: int, count: int, queue):
+    """Воркер: обрабатывает апдейты своих пользователей, полученные от супервизора"""
+    logger.info(f"Воркер {index + 1}/{count} запускается...")
+    
+    # Фоновые задачи воркера обслуживают только пользователей его шарда
+    lead_queue.shard_index = reminder_scheduler.shard_index = index
+    lead_queue.shard_count = reminder_scheduler.shard_count = count
+    rate_limiter.split(count)
+    # У каждого воркера свой порт метрик: METRICS_PORT + номер воркера
+    if metrics_server.port:
+        metrics_server.port += index
+    
+    try:
+        await start_services()
+        await OrderedUpdateFeeder(dp, bot).run(queue)
+    except Exception as e:
+        logger.error(f"Ошибка в воркере {index + 1}: {e}")
+    finally:
+        await stop_services()
+
+async def run_supervisor():
+    """Режим шардирования: супервизор получает апдейты и раздаёт их воркерам по user_id"""
+    try:
+        Config.validate()
+        
+        # Миграции применяем один раз, до запуска воркеров
+        await database.connect()
+        await init_db()
+        await database.close()
+        
+        supervisor = ShardSupervisor(Config.WORKERS, run_worker)
+        supervisor.start()
+        try:
+            if Config.BOT_MODE == 'webhook':
+                await run_webhook(dp, bot, route=supervisor.route)
+            else:
+                # Снимаем webhook, иначе getUpdates вернёт конфликт
+                await bot.delete_webhook()
+                stop_event = stop_signal_event()
+                polling = asyncio.create_task(
+                    poll_updates(bot, supervisor.route, dp.resolve_used_update_types())
+                )
+                logger.info("Start polling (супервизор)")
+                await stop_event.wait()
+                polling.cancel()
+        finally:
+            await supervisor.stop(Config.WEBHOOK_DRAIN_TIMEOUT)
+    except Exception as e:
+        logger.error(f"Ошибка при запуске бота: {e}")
+    finally:
+        await bot.session.close()
+
 async def main():
     """Основная функция запуска бота"""
     logger.info("Бот запускается...")
     
+    if Config.WORKERS > 1:
+        await run_supervisor()
+        return
+    
     try:
-        # Инициализируем базу данных
-        await init_db()
-        logger.info("База данных инициализирована")
+        await start_services()
         
         # Проверяем конфигурацию
         Config.validate()
         logger.info("Конфигурация проверена успешно")
         
         # Запускаем бота
-        await dp.start_polling(bot)
+        if Config.BOT_MODE == 'webhook':
+            await run_webhook(dp, bot)
+        else:
+            # Снимаем webhook, иначе getUpdates вернёт конфликт
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
     finally:
-        await bot.session.close()
+        await stop_services()
 
 if __name__ == "__main__":
     asyncio.run(main())
-
-
-
-
-
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк расчёта номера в очереди предзаписи на 100k строк prereg
+Сравнивает старый COUNT(*) по created_at с хранимым номером prereg.place
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Добавляем путь к src для импортов
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from database import Database
+
+ROWS = 100_000
+CALLS = 500
+
+async def fill(database: Database):
+    """Заполняет prereg тестовыми предзаписями"""
+    async with database.transaction() as db:
+        await db.execute("""CREATE TABLE prereg(
+            user_id INTEGER PRIMARY KEY,
+            code TEXT, tariff TEXT, valid_to TEXT, created_at TEXT, place INTEGER
+        )""")
+        await db.execute("CREATE UNIQUE INDEX idx_prereg_place ON prereg(place)")
+        start = datetime(2025, 1, 1)
+        await db.executemany(
+            "INSERT INTO prereg VALUES (?, ?, ?, ?, ?, ?)",
+            ((i, f"LOCK-{i:06d}", "Pro 2 990 ₽", "2026-01-01", (start + timedelta(seconds=i)).isoformat(), i)
+             for i in range(1, ROWS + 1))
+        )
+
+async def bench_old(database: Database) -> float:
+    """Старый вариант: upsert + COUNT(*) по неиндексированному created_at"""
+    started = time.perf_counter()
+    for i in range(CALLS):
+        user_id = ROWS // 2 + i
+        async with database.transaction() as db:
+            await db.execute("""
+                INSERT INTO prereg(user_id, code, tariff, valid_to, created_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET code=excluded.code, tariff=excluded.tariff, valid_to=excluded.valid_to
+            """, (user_id, "LOCK-OLD", "Pro 2 990 ₽", "2026-01-01", datetime.utcnow().isoformat()))
+            cur = await db.execute("SELECT COUNT(*) FROM prereg WHERE created_at <= (SELECT created_at FROM prereg WHERE user_id=?)", (user_id,))
+            await cur.fetchone()
+    return time.perf_counter() - started
+
+async def bench_new(database: Database) -> float:
+    """Новый вариант: Database.upsert_prereg с хранимым номером (повторные и новые записи)"""
+    started = time.perf_counter()
+    for i in range(CALLS):
+        # Чередуем повторное закрепление и новых пользователей
+        user_id = ROWS // 2 + i if i % 2 else ROWS + 1 + i
+        await database.upsert_prereg(user_id, "LOCK-NEW", "Pro 2 990 ₽", "2026-01-01", datetime.utcnow().isoformat())
+    return time.perf_counter() - started
+
+async def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        database = Database(os.path.join(tmp, "bench.db"))
+        await database.connect()
+        try:
+            await fill(database)
+            print(f"📦 prereg: {ROWS} строк, {CALLS} вызовов на вариант")
+
+            old = await bench_old(database)
+            print(f"🐢 COUNT(*) по created_at: {old / CALLS * 1000:.3f} мс/вызов")
+
+            new = await bench_new(database)
+            print(f"🚀 prereg.place:           {new / CALLS * 1000:.3f} мс/вызов")
+            print(f"📈 Ускорение: x{old / new:.1f}")
+        finally:
+            await database.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
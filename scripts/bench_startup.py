@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк времени запуска бота: от старта процесса `python main.py`
+до строки "Start polling" в логе
+
+Бот подключается к локальной замене Bot API (scripts/fake_bot_api.py),
+bot.db и логи создаются во временной директории. Google Sheets включен
+тестовым ключом сервисного аккаунта, чтобы замер включал инициализацию
+клиента Sheets, как в рабочем запуске. Первый запуск прогревает
+кэш байткода и в результат не входит.
+
+Пример:
+    python scripts/bench_startup.py --runs 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI
+
+MARKER = b'Start polling'
+
+def test_credentials() -> str:
+    """JSON сервисного аккаунта с одноразовым RSA-ключом (rsa — зависимость google-auth)"""
+    import rsa
+    _, private_key = rsa.newkeys(1024)
+    return json.dumps({
+        'type': 'service_account',
+        'project_id': 'bench',
+        'private_key_id': 'bench',
+        'private_key': private_key.save_pkcs1().decode('ascii'),
+        'client_email': 'bench@bench.iam.gserviceaccount.com',
+        'client_id': '1',
+        'token_uri': 'https://oauth2.googleapis.com/token',
+    })
+
+async def measure(env: Dict[str, str], timeout: float) -> float:
+    """Одиночный запуск: секунды до "Start polling"; затем бот останавливается по SIGINT"""
+    with tempfile.TemporaryDirectory(prefix='bench-startup-') as workdir:
+        os.makedirs(os.path.join(workdir, 'logs'))
+        env = dict(env, DB_PATH=os.path.join(workdir, 'bot.db'), PROFILE_DIR=os.path.join(workdir, 'profiles'))
+
+        started = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(ROOT, 'main.py'),
+            cwd=workdir, env=env, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            while True:
+                line = await asyncio.wait_for(process.stderr.readline(), timeout)
+                if not line:
+                    raise RuntimeError(f"main.py завершился до запуска polling (код {await process.wait()})")
+                if MARKER in line:
+                    return time.perf_counter() - started
+        finally:
+            if process.returncode is None:
+                process.send_signal(signal.SIGINT)
+                try:
+                    # stderr дочитывается, чтобы процесс не заблокировался на записи логов
+                    await asyncio.wait_for(process.communicate(), 15)
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+
+async def run(args):
+    api = FakeBotAPI(port=args.port)
+    await api.start()
+
+    env = dict(os.environ)
+    env.update({
+        'BOT_TOKEN': '123456:STARTUP',
+        'TELEGRAM_API_URL': api.base_url,
+        'PRIVATE_CHANNEL_ID': '-1001000000000',
+        'SHEET_ID': 'bench',
+        'METRICS_PORT': '0',
+        'WORKERS': '1',
+        'BOT_MODE': 'polling',
+    })
+    if args.no_sheets:
+        env.pop('GOOGLE_CREDENTIALS_JSON', None)
+    else:
+        env['GOOGLE_CREDENTIALS_JSON'] = test_credentials()
+
+    try:
+        await measure(env, args.timeout)
+        times = []
+        for i in range(args.runs):
+            elapsed = await measure(env, args.timeout)
+            times.append(elapsed)
+            print(f"  запуск {i + 1}: {elapsed * 1000:.0f} мс")
+    finally:
+        await api.stop()
+
+    print(f"\n🚀 До \"Start polling\" ({args.runs} запусков, Google Sheets "
+          f"{'выключен' if args.no_sheets else 'включен'}): медиана {statistics.median(times) * 1000:.0f} мс, "
+          f"минимум {min(times) * 1000:.0f} мс, максимум {max(times) * 1000:.0f} мс")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Время запуска main.py до начала polling")
+    parser.add_argument('--runs', type=int, default=5, help="количество замеров (плюс один прогревочный)")
+    parser.add_argument('--port', type=int, default=8082, help="порт заглушки Bot API")
+    parser.add_argument('--timeout', type=float, default=60, help="предельное время одного запуска, с")
+    parser.add_argument('--no-sheets', action='store_true', help="запуск без учетных данных Google")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Локальная замена Telegram Bot API для нагрузочных тестов
+
+Поддерживает методы, которые использует бот: getMe, getUpdates,
+setWebhook/deleteWebhook, sendMessage, editMessageText,
+editMessageReplyMarkup, answerCallbackQuery. Апдейты от виртуальных
+пользователей кладутся в очередь через push_update(), ответы бота
+попадают в очередь чата (outbox(chat_id)).
+"""
+
+import asyncio
+import itertools
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+BOT_USER = {'id': 100000, 'is_bot': True, 'first_name': 'LoadTestBot', 'username': 'loadtest_bot'}
+
+class FakeBotAPI:
+    """aiohttp-сервер с путями /bot<token>/<method> в формате Bot API"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8081):
+        self.host = host
+        self.port = port
+        self.calls: Dict[str, int] = {}
+
+        self._updates: List[Dict[str, Any]] = []
+        self._update_ids = itertools.count(1)
+        self._new_updates: Optional[asyncio.Event] = None
+        self._message_ids: Dict[int, itertools.count] = {}
+        self._outboxes: Dict[int, asyncio.Queue] = {}
+        self._callback_chats: Dict[str, int] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._new_updates = asyncio.Event()
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def outbox(self, chat_id: int) -> asyncio.Queue:
+        """Очередь вызовов бота, адресованных чату (сообщения, правки, ответы на callback)"""
+        queue = self._outboxes.get(chat_id)
+        if queue is None:
+            queue = self._outboxes[chat_id] = asyncio.Queue()
+        return queue
+
+    def push_update(self, update: Dict[str, Any]) -> Dict[str, Any]:
+        """Ставит апдейт в очередь getUpdates и возвращает его с update_id"""
+        update = {'update_id': next(self._update_ids), **update}
+        callback = update.get('callback_query')
+        if callback:
+            self._callback_chats[callback['id']] = callback['from']['id']
+        self._updates.append(update)
+        self._new_updates.set()
+        return update
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = dict(await request.post())
+        if not params and request.can_read_body:
+            params = await request.json()
+
+        handler = getattr(self, f"_method_{method}", None)
+        if handler is None:
+            return web.json_response({'ok': True, 'result': True})
+        return web.json_response({'ok': True, 'result': await handler(params)})
+
+    async def _method_getme(self, params):
+        return BOT_USER
+
+    async def _method_setwebhook(self, params):
+        return True
+
+    async def _method_deletewebhook(self, params):
+        return True
+
+    async def _method_getupdates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+
+        # Подтверждённые апдейты (update_id < offset) удаляются, как в Bot API
+        if offset:
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    async def _method_sendmessage(self, params):
+        chat_id = int(params['chat_id'])
+        counter = self._message_ids.setdefault(chat_id, itertools.count(1))
+        message = self._message(chat_id, next(counter), params)
+        self.outbox(chat_id).put_nowait(('sendMessage', message, time.perf_counter()))
+        return message
+
+    async def _method_editmessagetext(self, params):
+        chat_id = int(params['chat_id'])
+        message = self._message(chat_id, int(params['message_id']), params)
+        self.outbox(chat_id).put_nowait(('editMessageText', message, time.perf_counter()))
+        return message
+
+    async def _method_editmessagereplymarkup(self, params):
+        chat_id = int(params['chat_id'])
+        message = self._message(chat_id, int(params['message_id']), params)
+        self.outbox(chat_id).put_nowait(('editMessageReplyMarkup', message, time.perf_counter()))
+        return message
+
+    async def _method_answercallbackquery(self, params):
+        chat_id = self._callback_chats.pop(params['callback_query_id'], None)
+        if chat_id is not None:
+            self.outbox(chat_id).put_nowait(('answerCallbackQuery', None, time.perf_counter()))
+        return True
+
+    @staticmethod
+    def _message(chat_id: int, message_id: int, params: Dict[str, Any]) -> Dict[str, Any]:
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'channel'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+        markup = params.get('reply_markup')
+        if markup:
+            message['reply_markup'] = json.loads(markup) if isinstance(markup, str) else markup
+        return message
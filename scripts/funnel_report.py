@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Отчёт по воронке анкеты из bot.db: конверсия start→complete,
+распределение ответов по utm_source / utm_medium / utm_campaign и отсев
+по вопросам анкеты со временем на вопрос
+
+Читает только rollup-таблицы (utm_funnel_daily, utm_answers_daily,
+survey_step_daily), поэтому работает быстро при любом числе событий.
+
+Пример:
+    python scripts/funnel_report.py --by campaign --since 2025-01-01
+    python scripts/funnel_report.py --by source,medium --answers
+    python scripts/funnel_report.py --by campaign --answers --question price
+    python scripts/funnel_report.py --steps --since 2025-01-01
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+from typing import List
+
+# Добавляем путь к src для импортов
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from config import Config
+from database import Database
+from funnel import GROUPS, FunnelReport
+from survey_steps import SurveyStepReport
+
+EMPTY = '(нет)'
+
+def group_label(group) -> str:
+    return ' / '.join(value or EMPTY for value in group.values()) or 'Все'
+
+def print_conversion(rows, min_starts: int):
+    print(f"{'UTM':<40}{'запуски':>10}{'анкеты':>10}{'конверсия':>12}")
+    for row in rows:
+        if row['starts'] < min_starts:
+            continue
+        conversion = f"{row['conversion'] * 100:.1f}%" if row['conversion'] is not None else '—'
+        print(f"{group_label(row['group'])[:39]:<40}{row['starts']:>10}{row['completes']:>10}{conversion:>12}")
+
+def print_answers(rows):
+    current = None
+    for row in rows:
+        key = (group_label(row['group']), row['question_id'])
+        if key != current:
+            current = key
+            print(f"\n{key[0]} — {key[1]}")
+        print(f"  {row['leads']:>8}  {row['answer']}")
+
+def print_steps(rows):
+    print(f"{'вопрос':<16}{'показы':>9}{'ответы':>9}{'отсев':>9}{'p50, с':>9}{'p90, с':>9}{'p99, с':>9}")
+    for row in rows:
+        drop = f"{row['drop_rate'] * 100:.1f}%" if row['drop_rate'] is not None else '—'
+        dwell = ''.join(f"{row['dwell'][q]:>9.1f}" if row['dwell'] else f"{'—':>9}" for q in (0.5, 0.9, 0.99))
+        print(f"{row['question_id'][:15]:<16}{row['reached']:>9}{row['answered']:>9}{drop:>9}{dwell}")
+
+async def main(args):
+    group_by: List[str] = [name for name in args.by.split(',') if name]
+    unknown = [name for name in group_by if name not in GROUPS]
+    if unknown:
+        sys.exit(f"Неизвестная группировка: {', '.join(unknown)} (доступно: {', '.join(GROUPS)})")
+
+    database = Database(args.db)
+    await database.connect()
+    try:
+        if args.steps:
+            print(f"🪜 Шаги анкеты ({args.since or 'начало'} — {args.until or 'сегодня'}): "
+                  f"отсев — показали, но ответа нет\n")
+            print_steps(await SurveyStepReport(database).steps(args.since, args.until))
+            return
+
+        report = FunnelReport(database)
+        print(f"📊 Конверсия start→complete ({args.since or 'начало'} — {args.until or 'сегодня'})\n")
+        print_conversion(await report.conversion(group_by, args.since, args.until), args.min_starts)
+        if args.answers or args.question:
+            print("\n📋 Ответы завершивших анкету")
+            print_answers(await report.answers(group_by, args.since, args.until, args.question))
+    finally:
+        await database.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Воронка анкеты по UTM-меткам")
+    parser.add_argument('--db', default=Config.DB_PATH, help="путь к bot.db")
+    parser.add_argument('--by', default='source,medium,campaign',
+                        help="группировка через запятую: source, medium, campaign (пусто — итого)")
+    parser.add_argument('--since', help="с даты, ГГГГ-ММ-ДД")
+    parser.add_argument('--until', help="по дату включительно, ГГГГ-ММ-ДД")
+    parser.add_argument('--min-starts', type=int, default=0, help="скрыть группы с меньшим числом запусков")
+    parser.add_argument('--answers', action='store_true', help="распределение ответов по группам")
+    parser.add_argument('--question', help="только этот вопрос (id из SURVEY_CONFIG)")
+    parser.add_argument('--steps', action='store_true', help="отсев и время на вопрос по шагам анкеты")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
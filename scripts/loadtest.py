@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест бота на локальной замене Telegram Bot API
+
+Виртуальные пользователи приходят по /start с UTM-параметрами, проходят
+анкету, закрепляют предзапись и открывают демо. Google Sheets заменён
+заглушкой с настраиваемой задержкой. В конце печатаются пропускная
+способность и p50/p95/p99 задержки ответа бота по шагам.
+
+Пример:
+    python scripts/loadtest.py --users 2000 --concurrency 500
+    python scripts/loadtest.py --users 500 --no-limits --edit-in-place
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'src'))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI
+
+UTM_SOURCES = ['vk', 'telegram_ads', 'yandex', 'blogger']
+
+class StubSheetsService:
+    """Заглушка googleapiclient: spreadsheets().values().append(...).execute() с задержкой"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.appended_rows = 0
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def append(self, body: Dict[str, Any], **kwargs):
+        return _StubRequest(self, len(body['values']))
+
+class _StubRequest:
+    def __init__(self, service: StubSheetsService, rows: int):
+        self.service = service
+        self.rows = rows
+
+    def execute(self):
+        # Выполняется в потоке GoogleSheetsManager, как настоящий HTTP-запрос
+        time.sleep(self.service.latency)
+        self.service.appended_rows += self.rows
+        return {'updates': {'updatedRows': self.rows}}
+
+class StepTimeout(Exception):
+    pass
+
+class VirtualUser:
+    """Пользователь, который отвечает на кнопки, показанные ботом"""
+
+    def __init__(self, api: FakeBotAPI, user_id: int, latencies: Dict[str, List[float]],
+                 step_timeout: float, think: float):
+        self.api = api
+        self.user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+        self.latencies = latencies
+        self.step_timeout = step_timeout
+        self.think = think
+        self.random = random.Random(user_id)
+        self.outbox = api.outbox(user_id)
+
+    async def run(self):
+        utm = {'utm_source': self.random.choice(UTM_SOURCES), 'utm_campaign': 'loadtest'}
+        payload = base64.b64encode(json.dumps(utm).encode('utf-8')).decode('ascii')
+        message = await self._send_text(f"/start {payload}", 'start', self._has_button('welcome:'))
+
+        message = await self._click(message, 'welcome:0', 'welcome', self._has_button('answer:', 'final:'))
+        while not self._buttons(message, 'final:'):
+            answers = self._buttons(message, 'answer:')
+            if self._buttons(message, 'next:'):
+                # Множественный выбор: отмечаем вариант и нажимаем "Далее"
+                message = await self._click(message, self.random.choice(answers), 'multi_toggle',
+                                            self._has_button('next:'))
+                data = self._buttons(message, 'next:')[0]
+            else:
+                data = self.random.choice(answers)
+            message = await self._click(message, data, 'answer', self._has_button('answer:', 'final:'))
+
+        await self._click(message, 'final:0', 'prereg', lambda method, m: m is not None and 'очереди' in m['text'])
+        await self._click(message, 'final:1', 'demo', self._has_button('demo:'))
+
+    async def _send_text(self, text: str, step: str, expect):
+        update = {'message': {
+            'message_id': self.random.randint(1, 10 ** 9), 'date': int(time.time()),
+            'chat': {'id': self.user['id'], 'type': 'private'}, 'from': self.user, 'text': text,
+        }}
+        return await self._push(update, step, expect)
+
+    async def _click(self, message: Dict[str, Any], data: str, step: str, expect):
+        if self.think:
+            await asyncio.sleep(self.think)
+        update = {'callback_query': {
+            'id': uuid.uuid4().hex, 'from': self.user, 'chat_instance': str(self.user['id']),
+            'data': data, 'message': message,
+        }}
+        return await self._push(update, step, expect)
+
+    async def _push(self, update: Dict[str, Any], step: str, expect: Callable) -> Dict[str, Any]:
+        started = time.perf_counter()
+        self.api.push_update(update)
+        first_response = None
+        deadline = started + self.step_timeout
+        while True:
+            try:
+                method, message, at = await asyncio.wait_for(self.outbox.get(), max(deadline - time.perf_counter(), 0))
+            except asyncio.TimeoutError:
+                raise StepTimeout(step)
+            if first_response is None:
+                first_response = at
+                self.latencies.setdefault('first_response', []).append(at - started)
+            if expect(method, message):
+                self.latencies.setdefault(step, []).append(at - started)
+                return message
+
+    @staticmethod
+    def _buttons(message: Optional[Dict[str, Any]], prefix: str) -> List[str]:
+        if not message:
+            return []
+        rows = message.get('reply_markup', {}).get('inline_keyboard', [])
+        return [button['callback_data'] for row in rows for button in row
+                if button.get('callback_data', '').startswith(prefix)]
+
+    def _has_button(self, *prefixes: str):
+        return lambda method, message: any(self._buttons(message, prefix) for prefix in prefixes)
+
+def percentile(values: List[float], p: float) -> float:
+    """Перцентиль по методу ближайшего ранга (values отсортирован)"""
+    if not values:
+        return 0.0
+    index = max(int(round(p / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+def configure(args):
+    """Переменные окружения для бота: задаются до импорта main"""
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    os.environ.update({
+        'BOT_TOKEN': '123456:LOADTEST',
+        'PRIVATE_CHANNEL_ID': '-1001000000000',
+        'SHEET_ID': 'loadtest',
+        'TELEGRAM_API_URL': f"http://127.0.0.1:{args.port}",
+        'DB_PATH': os.path.join(workdir, 'bot.db'),
+        'PROFILE_DIR': os.path.join(workdir, 'profiles'),
+        'METRICS_PORT': '0',
+        'SURVEY_EDIT_IN_PLACE': 'true' if args.edit_in_place else 'false',
+    })
+    if args.no_limits:
+        os.environ.update({
+            'TG_GLOBAL_RATE': '1000000', 'TG_CHAT_RATE': '1000000', 'TG_CHAT_BURST': '1000000',
+            'TG_GROUP_RATE': '1000000', 'TG_GROUP_BURST': '1000000',
+        })
+    # main настраивает логирование в logs/bot.log только если логирование ещё не настроено
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    return workdir
+
+async def run(args):
+    workdir = configure(args)
+    import main
+
+    api = FakeBotAPI(port=args.port)
+    await api.start()
+
+    sheets = StubSheetsService(args.sheets_latency)
+    main.sheets_manager.service = sheets
+    main.sheets_manager.enabled = True
+
+    await main.start_services()
+    polling = asyncio.create_task(main.dp.start_polling(main.bot, handle_signals=False, close_bot_session=False))
+
+    latencies: Dict[str, List[float]] = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    completed = 0
+    failures: Dict[str, int] = {}
+
+    async def user_session(index: int):
+        nonlocal completed
+        async with semaphore:
+            user = VirtualUser(api, 1_000_000 + index, latencies, args.step_timeout, args.think)
+            try:
+                await user.run()
+                completed += 1
+            except StepTimeout as e:
+                failures[f"timeout:{e}"] = failures.get(f"timeout:{e}", 0) + 1
+            except Exception as e:
+                failures[type(e).__name__] = failures.get(type(e).__name__, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user_session(i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    await main.dp.stop_polling()
+    await polling
+    await main.stop_services()
+    await api.stop()
+
+    updates = sum(len(values) for step, values in latencies.items() if step != 'first_response')
+    print(f"\nПользователей: {args.users}, одновременно: {args.concurrency}, "
+          f"лимиты Telegram: {'выключены' if args.no_limits else 'включены'}, "
+          f"edit-in-place: {'да' if args.edit_in_place else 'нет'}")
+    print(f"Завершили сценарий: {completed}, ошибок: {sum(failures.values())} {failures or ''}")
+    print(f"Время: {elapsed:.1f} с, апдейтов: {updates} ({updates / elapsed:.1f}/с), "
+          f"анкет: {completed / elapsed:.1f}/с, строк в Sheets: {sheets.appended_rows}")
+    print(f"\n{'шаг':<16}{'n':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'max, мс':>10}")
+    for step, values in latencies.items():
+        values.sort()
+        print(f"{step:<16}{len(values):>8}" + ''.join(
+            f"{percentile(values, p) * 1000:>10.1f}" for p in (50, 95, 99)
+        ) + f"{values[-1] * 1000:>10.1f}")
+    calls = ', '.join(f"{method}={count}" for method, count in sorted(api.calls.items()))
+    print(f"\nВызовы Bot API: {calls}")
+    print(f"Вызовов Bot API на анкету: {sum(api.calls.values()) / max(completed, 1):.1f} "
+          f"(без getUpdates: {(sum(api.calls.values()) - api.calls.get('getupdates', 0)) / max(completed, 1):.1f})")
+    print(f"Рабочая директория (bot.db, профили): {workdir}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на локальной замене Bot API")
+    parser.add_argument('--users', type=int, default=1000, help="количество виртуальных пользователей")
+    parser.add_argument('--concurrency', type=int, default=200, help="сколько пользователей проходят сценарий одновременно")
+    parser.add_argument('--port', type=int, default=8081, help="порт заглушки Bot API")
+    parser.add_argument('--sheets-latency', type=float, default=0.3, help="задержка append в заглушке Sheets, с")
+    parser.add_argument('--step-timeout', type=float, default=60, help="ожидание ответа бота на шаг, с")
+    parser.add_argument('--think', type=float, default=0, help="пауза пользователя перед нажатием кнопки, с")
+    parser.add_argument('--no-limits', action='store_true', help="отключить лимиты отправки Telegram")
+    parser.add_argument('--edit-in-place', action='store_true', help="SURVEY_EDIT_IN_PLACE=true")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -6,10 +6,10 @@
 
 import asyncio
 from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
 from config import Config
+from google_sheets_manager import SCOPES, build_sheets_service
 from utils import DataFormatter, logger
 
 async def setup_google_sheets():
@@ -19,9 +19,9 @@ async def setup_google_sheets():
         # Инициализируем Google Sheets API
         credentials = Credentials.from_service_account_file(
             Config.GOOGLE_SHEETS_CREDENTIALS_FILE,
-            scopes=['https://www.googleapis.com/auth/spreadsheets']
+            scopes=SCOPES
         )
-        service = build('sheets', 'v4', credentials=credentials)
+        service = build_sheets_service(credentials)
         
         # Получаем заголовки
         headers = DataFormatter.get_sheet_headers()
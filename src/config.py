@@ -16,6 +16,46 @@ class Config:
     # Telegram Bot Configuration
     BOT_TOKEN = os.getenv('BOT_TOKEN')
     PRIVATE_CHANNEL_ID = os.getenv('PRIVATE_CHANNEL_ID')
+    # ID администраторов через запятую: доступ к /stats, /leads и /resend
+    ADMIN_USER_IDS = [int(user_id) for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip()]
+    # Адрес локального Bot API сервера (например, http://127.0.0.1:8081); пусто — api.telegram.org
+    TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+    
+    # Режим получения апдейтов: polling или webhook
+    BOT_MODE = os.getenv('BOT_MODE', 'polling')
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL')                                   # внешний https-адрес, без пути
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')                             # X-Telegram-Bot-Api-Secret-Token
+    WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+    WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', os.getenv('PORT', '8080')))
+    WEBHOOK_DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', '30'))  # ожидание апдейтов при остановке
+    
+    # Анкета в одном сообщении: каждый вопрос заменяет предыдущий через editMessageText
+    SURVEY_EDIT_IN_PLACE = os.getenv('SURVEY_EDIT_IN_PLACE', 'false').lower() in ('1', 'true', 'yes')
+    
+    # Размер кэша клавиатур множественного выбора (варианты по маске выбранных ответов)
+    KEYBOARD_CACHE_SIZE = int(os.getenv('KEYBOARD_CACHE_SIZE', '256'))
+    
+    # Количество процессов-воркеров; больше 1 — шардирование апдейтов по user_id
+    WORKERS = int(os.getenv('WORKERS', '1'))
+    # Упавший воркер перезапускается; больше WORKER_MAX_RESTARTS падений за WORKER_RESTART_WINDOW — бот останавливается
+    WORKER_CHECK_INTERVAL = float(os.getenv('WORKER_CHECK_INTERVAL', '5'))      # секунд
+    WORKER_MAX_RESTARTS = int(os.getenv('WORKER_MAX_RESTARTS', '5'))
+    WORKER_RESTART_WINDOW = float(os.getenv('WORKER_RESTART_WINDOW', '300'))    # секунд
+    
+    # Уведомления о лидах: больше NOTIFY_DIGEST_THRESHOLD лидов за интервал — одна сводка за интервал (0 — выключено)
+    NOTIFY_DIGEST_THRESHOLD = int(os.getenv('NOTIFY_DIGEST_THRESHOLD', '20'))
+    NOTIFY_DIGEST_INTERVAL = float(os.getenv('NOTIFY_DIGEST_INTERVAL', '60'))   # секунд
+    
+    # Метрики Prometheus: GET http://METRICS_HOST:METRICS_PORT/metrics (0 — выключено)
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+    
+    # Профилирование медленных апдейтов
+    PROFILE_SLOW_THRESHOLD = float(os.getenv('PROFILE_SLOW_THRESHOLD', '2'))  # секунд; дольше — снимается стек
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))       # доля апдейтов под cProfile
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'logs/profiles')
+    PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '100'))           # сколько последних файлов хранить
     
     # Google Sheets Configuration
     SHEET_ID = os.getenv('SHEET_ID')
@@ -26,6 +66,38 @@ class Config:
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
     
+    # База данных
+    DB_PATH = os.getenv('DB_PATH', 'bot.db')
+    DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))       # ожидание блокировки записи
+    DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '20000'))          # кэш страниц SQLite
+    
+    # Буфер аналитических событий
+    EVENTS_BATCH_SIZE = int(os.getenv('EVENTS_BATCH_SIZE', '200'))           # событий в одной транзакции
+    EVENTS_FLUSH_INTERVAL = float(os.getenv('EVENTS_FLUSH_INTERVAL', '2'))   # секунд между записями
+    EVENTS_MAX_BUFFER = int(os.getenv('EVENTS_MAX_BUFFER', '10000'))         # предел буфера при сбоях записи
+    # Ответ позже этого срока после показа вопроса не входит во время на вопрос (вопрос считается брошенным)
+    SURVEY_STEP_TIMEOUT = float(os.getenv('SURVEY_STEP_TIMEOUT', '86400'))  # секунд
+    
+    # Лимиты исходящих сообщений Telegram
+    TG_GLOBAL_RATE = float(os.getenv('TG_GLOBAL_RATE', '30'))               # сообщений в секунду на бота
+    TG_CHAT_RATE = float(os.getenv('TG_CHAT_RATE', '1'))                    # сообщений в секунду в личный чат
+    TG_CHAT_BURST = float(os.getenv('TG_CHAT_BURST', '5'))                  # допустимая пачка подряд в личный чат
+    TG_GROUP_RATE = float(os.getenv('TG_GROUP_RATE', '0.33'))               # сообщений в секунду в группу/канал
+    TG_GROUP_BURST = float(os.getenv('TG_GROUP_BURST', '3'))
+    
+    # Хранилище FSM
+    FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', '10000'))              # сессий в LRU-кэше
+    FSM_SESSION_TTL = float(os.getenv('FSM_SESSION_TTL', str(7 * 24 * 3600)))  # секунд до удаления брошенной сессии
+    FSM_SWEEP_INTERVAL = float(os.getenv('FSM_SWEEP_INTERVAL', '3600'))     # секунд между очистками
+    
+    # Напоминания
+    REMINDERS_BATCH_SIZE = int(os.getenv('REMINDERS_BATCH_SIZE', '30'))     # напоминаний за один проход
+    
+    # Очередь выгрузки лидов в Google Sheets
+    SHEETS_BATCH_SIZE = int(os.getenv('SHEETS_BATCH_SIZE', '50'))            # строк в одном append
+    SHEETS_FLUSH_INTERVAL = float(os.getenv('SHEETS_FLUSH_INTERVAL', '5'))   # секунд между выгрузками
+    SHEETS_MAX_BACKOFF = float(os.getenv('SHEETS_MAX_BACKOFF', '300'))       # максимальная пауза при 429/5xx
+    
     @classmethod
     def validate(cls):
         """Проверяет обязательные переменные окружения"""
@@ -40,6 +112,9 @@ class Config:
             if not getattr(cls, var):
                 missing_vars.append(var)
         
+        if cls.BOT_MODE == 'webhook' and not cls.WEBHOOK_URL:
+            missing_vars.append('WEBHOOK_URL')
+        
         if missing_vars:
             raise ValueError(f"Отсутствуют обязательные переменные окружения: {', '.join(missing_vars)}")
         
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Общее подключение к базе данных SQLite (bot.db)
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Optional, Tuple
+
+import aiosqlite
+
+from config import Config
+from metrics import Histogram, SQLITE_LOCK_WAIT, SQLITE_TRANSACTION_LATENCY
+
+SQLITE_QUERY_LATENCY = Histogram('bot_sqlite_query_duration_seconds', 'bot.db query duration', ['statement'])
+
+logger = logging.getLogger(__name__)
+
+class _TimedConnection:
+    """Обёртка подключения: замеряет execute/executemany по типу запроса (SELECT, INSERT, ...)"""
+
+    __slots__ = ('_conn',)
+
+    def __init__(self, conn: aiosqlite.Connection):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    async def execute(self, sql: str, parameters=None):
+        with SQLITE_QUERY_LATENCY.time(statement=sql.split(None, 1)[0].upper()):
+            return await self._conn.execute(sql, parameters)
+
+    async def executemany(self, sql: str, parameters):
+        with SQLITE_QUERY_LATENCY.time(statement=sql.split(None, 1)[0].upper()):
+            return await self._conn.executemany(sql, parameters)
+
+class Database:
+    """Одно долгоживущее подключение aiosqlite, общее для всех обработчиков.
+
+    Подключение открывается при старте бота и закрывается в main(). Чтение
+    выполняется напрямую через conn, а запись — через transaction(), чтобы
+    коммит или откат одного обработчика не затрагивал чужие изменения.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[_TimedConnection] = None
+        self._write_lock: Optional[asyncio.Lock] = None
+
+    async def connect(self):
+        """Открывает подключение к базе данных"""
+        if self._conn is not None:
+            return
+        # Lock создаём внутри работающего loop (в Python 3.9 он привязывается к loop при создании)
+        self._write_lock = asyncio.Lock()
+        self._conn = _TimedConnection(await aiosqlite.connect(self.path))
+        # WAL: читатели не блокируют писателя, коммит без полного fsync журнала отката
+        await self._conn.execute("PRAGMA journal_mode=WAL")
+        await self._conn.execute("PRAGMA synchronous=NORMAL")
+        await self._conn.execute(f"PRAGMA busy_timeout={int(Config.DB_BUSY_TIMEOUT_MS)}")
+        # Отрицательное значение — размер кэша в КиБ
+        await self._conn.execute(f"PRAGMA cache_size=-{int(Config.DB_CACHE_SIZE_KB)}")
+        logger.info(f"Подключение к базе данных открыто: {self.path}")
+
+    async def close(self):
+        """Закрывает подключение к базе данных"""
+        if self._conn is None:
+            return
+        await self._conn.close()
+        self._conn = None
+        logger.info("Подключение к базе данных закрыто")
+
+    @property
+    def conn(self) -> _TimedConnection:
+        if self._conn is None:
+            raise RuntimeError("База данных не подключена. Вызовите Database.connect()")
+        return self._conn
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Выполняет запись в одной транзакции: коммит при успехе, откат при ошибке"""
+        started = time.perf_counter()
+        async with self._write_lock:
+            locked = time.perf_counter()
+            SQLITE_LOCK_WAIT.observe(locked - started)
+            try:
+                yield self.conn
+                await self.conn.commit()
+            except BaseException:
+                # BaseException: отменённая задача (CancelledError) тоже не должна оставить
+                # открытую транзакцию, которую закоммитит следующий писатель
+                await self.conn.rollback()
+                raise
+            finally:
+                SQLITE_TRANSACTION_LATENCY.observe(time.perf_counter() - locked)
+
+    async def upsert_prereg(self, user_id: int, code: str, tariff: str, valid_to: str, created_at: str) -> int:
+        """Создаёт или обновляет предзапись и возвращает номер в очереди.
+
+        Номер выдаётся один раз при первой записи (MAX(place) + 1 по уникальному индексу),
+        повторное закрепление обновляет код и тариф, сохраняя место в очереди. Номер
+        вычисляется в том же INSERT, что и запись: SQLite выполняет его под блокировкой
+        записи, поэтому воркеры в разных процессах не получат одинаковый номер.
+        """
+        async with self.transaction() as db:
+            # WHERE true нужен SQLite, чтобы отличить ON CONFLICT от условия JOIN в INSERT ... SELECT
+            await db.execute(
+                "INSERT INTO prereg(user_id, code, tariff, valid_to, created_at, place) "
+                "SELECT ?, ?, ?, ?, ?, COALESCE(MAX(place), 0) + 1 FROM prereg WHERE true "
+                "ON CONFLICT(user_id) DO UPDATE SET "
+                "code = excluded.code, tariff = excluded.tariff, valid_to = excluded.valid_to",
+                (user_id, code, tariff, valid_to, created_at)
+            )
+            cur = await db.execute("SELECT place FROM prereg WHERE user_id=?", (user_id,))
+            return (await cur.fetchone())[0]
+
+    async def get_prereg(self, user_id: int) -> Optional[Tuple[str, str, str]]:
+        """Возвращает (code, tariff, valid_to) предзаписи пользователя"""
+        cur = await self.conn.execute("SELECT code, tariff, valid_to FROM prereg WHERE user_id=?", (user_id,))
+        return await cur.fetchone()
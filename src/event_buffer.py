@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Буфер аналитических событий с отложенной записью в таблицу events
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class EventBuffer:
+    """Копит события в памяти и записывает их пачкой через executemany.
+
+    Обработчики вызывают add() без ожидания диска; фоновая задача сбрасывает
+    буфер по таймеру или при накоплении batch_size событий, а stop() — при остановке.
+    Агрегаторы (aggregators) получают ту же пачку в той же транзакции и обновляют
+    свои сводные таблицы: при ошибке откатываются и события, и сводки.
+    """
+
+    def __init__(self, database, batch_size: int = None, flush_interval: float = None,
+                 max_size: int = None):
+        self.database = database
+        self.batch_size = batch_size or Config.EVENTS_BATCH_SIZE
+        self.flush_interval = flush_interval or Config.EVENTS_FLUSH_INTERVAL
+        self.max_size = max_size or Config.EVENTS_MAX_BUFFER
+
+        # Корутины aggregator(db, batch), задаются в main.py
+        self.aggregators: List[Callable[[Any, List[Tuple[int, str, str, str]]], Awaitable[None]]] = []
+
+        self._buffer: List[Tuple[int, str, str, str]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    async def start(self):
+        """Запускает фоновую запись событий"""
+        # Event создаём внутри работающего loop (в Python 3.9 он привязывается к loop при создании)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def add(self, user_id: int, event: str, payload: str = ""):
+        """Добавляет событие в буфер, не дожидаясь записи на диск"""
+        self._buffer.append((user_id, event, payload, datetime.utcnow().isoformat()))
+        if len(self._buffer) >= self.batch_size and self._wakeup:
+            self._wakeup.set()
+
+    async def stop(self):
+        """Останавливает фоновую запись и сбрасывает остаток буфера"""
+        if self._task:
+            # Не отменяем задачу посреди flush(): отмена внутри транзакции
+            # потеряла бы пачку, уже вынутую из буфера
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+        if self._buffer:
+            await self.flush()
+        if self._buffer:
+            logger.error(f"При остановке не удалось записать событий: {len(self._buffer)}")
+
+    async def flush(self):
+        """Записывает накопленные события одной транзакцией"""
+        if not self._buffer:
+            return
+
+        batch, self._buffer = self._buffer, []
+        try:
+            async with self.database.transaction() as db:
+                await db.executemany("INSERT INTO events(user_id,event,payload,ts) VALUES(?,?,?,?)", batch)
+                for aggregator in self.aggregators:
+                    await aggregator(db, batch)
+        except Exception as e:
+            logger.error(f"Ошибка записи событий в базу данных: {e}")
+            # Возвращаем события в буфер, но не даём ему расти бесконечно
+            self._buffer = batch + self._buffer
+            overflow = len(self._buffer) - self.max_size
+            if overflow > 0:
+                del self._buffer[:overflow]
+                logger.warning(f"Буфер событий переполнен, отброшено старых событий: {overflow}")
+
+    async def _run(self):
+        """Цикл записи: по таймеру или при накоплении batch_size событий"""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
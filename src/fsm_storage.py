@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Хранилище FSM в SQLite (bot.db) с LRU-кэшем в памяти
+"""
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Данные новой или завершённой сессии
+_EMPTY = json.dumps({})
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage с записью в таблицу fsm_sessions и write-through кэшем.
+
+    Недавно активные сессии читаются из ограниченного LRU-кэша без обращения
+    к диску; каждое изменение сразу записывается в базу, поэтому незаконченные
+    анкеты переживают перезапуск. Кэш хранит данные тем же JSON, что и база:
+    get_data каждый раз возвращает новую копию, и изменения вложенных словарей
+    без set_data не попадают ни в кэш, ни в базу. Фоновая задача удаляет сессии,
+    которые не обновлялись дольше FSM_SESSION_TTL.
+    """
+
+    def __init__(self, database, cache_size: int = None, ttl: float = None, sweep_interval: float = None):
+        self.database = database
+        self.cache_size = cache_size or Config.FSM_CACHE_SIZE
+        self.ttl = ttl or Config.FSM_SESSION_TTL
+        self.sweep_interval = sweep_interval or Config.FSM_SWEEP_INTERVAL
+
+        # key → (state, data в JSON)
+        self._cache: "OrderedDict[str, Tuple[Optional[str], str]]" = OrderedDict()
+        self._sweeper: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Запускает фоновую очистку брошенных сессий"""
+        self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def close(self) -> None:
+        if self._sweeper:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        _, data_json = await self._load(self._key(key))
+        await self._save(self._key(key), state, data_json)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(self._key(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        state, _ = await self._load(self._key(key))
+        await self._save(self._key(key), state, json.dumps(data, ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data_json = await self._load(self._key(key))
+        return json.loads(data_json)
+
+    @property
+    def cached_sessions(self) -> int:
+        """Количество сессий в кэше"""
+        return len(self._cache)
+
+    async def count_sessions(self) -> int:
+        """Количество активных сессий в базе"""
+        cur = await self.database.conn.execute("SELECT COUNT(*) FROM fsm_sessions")
+        return (await cur.fetchone())[0]
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    async def _load(self, key: str) -> Tuple[Optional[str], str]:
+        """Читает сессию (state, data в JSON) из кэша, при промахе — из базы"""
+        record = self._cache.get(key)
+        if record is not None:
+            self._cache.move_to_end(key)
+            return record
+
+        cur = await self.database.conn.execute("SELECT state, data FROM fsm_sessions WHERE key=?", (key,))
+        row = await cur.fetchone()
+        record = (row[0], row[1]) if row else (None, _EMPTY)
+        self._remember(key, record)
+        return record
+
+    async def _save(self, key: str, state: Optional[str], data_json: str):
+        """Записывает сессию в базу и после успешной записи обновляет кэш"""
+        async with self.database.transaction() as db:
+            if state is None and data_json == _EMPTY:
+                # state.clear() — сессия завершена, строку не храним
+                await db.execute("DELETE FROM fsm_sessions WHERE key=?", (key,))
+            else:
+                await db.execute("""
+                    INSERT INTO fsm_sessions(key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET state=excluded.state, data=excluded.data, updated_at=excluded.updated_at
+                """, (key, state, data_json, time.time()))
+        # Если запись не удалась, в кэше остаётся версия, совпадающая с базой
+        self._remember(key, (state, data_json))
+
+    def _remember(self, key: str, record: Tuple[Optional[str], str]):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _sweep_loop(self):
+        """Периодически удаляет сессии, брошенные дольше TTL"""
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Ошибка очистки FSM-сессий: {e}")
+
+    async def sweep(self) -> int:
+        """Удаляет просроченные сессии из базы и кэша. Возвращает их количество"""
+        expired_before = time.time() - self.ttl
+        cur = await self.database.conn.execute(
+            "SELECT key FROM fsm_sessions WHERE updated_at < ?", (expired_before,)
+        )
+        keys = [row[0] for row in await cur.fetchall()]
+        if not keys:
+            return 0
+
+        async with self.database.transaction() as db:
+            await db.execute("DELETE FROM fsm_sessions WHERE updated_at < ?", (expired_before,))
+        for key in keys:
+            self._cache.pop(key, None)
+        logger.info(f"Удалено брошенных FSM-сессий: {len(keys)}")
+        return len(keys)
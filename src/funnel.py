@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Воронка анкеты по UTM-меткам: запуски, завершения и распределение ответов
+
+Сырые события остаются в таблице events, а отчёты читают только
+предагрегированные таблицы (rollup) по дню и UTM-меткам:
+
+- utm_funnel_daily — запуски и завершения анкеты;
+- utm_answers_daily — сколько завершивших выбрали каждый вариант ответа.
+
+Запуски попадают в rollup при записи пачки событий EventBuffer (в той же
+транзакции), завершения и ответы — при записи лида в outbox.
+"""
+
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+START_EVENT = 'survey_start'
+
+# Измерения отчёта в порядке вложенности
+UTM_FIELDS = ('utm_source', 'utm_medium', 'utm_campaign')
+GROUPS = {'source': 'utm_source', 'medium': 'utm_medium', 'campaign': 'utm_campaign'}
+
+def utm_key(utm_data: Optional[Dict[str, Any]]) -> Tuple[str, str, str]:
+    """(utm_source, utm_medium, utm_campaign); отсутствующая метка — пустая строка"""
+    utm_data = utm_data or {}
+    return tuple(str(utm_data.get(field) or '') for field in UTM_FIELDS)
+
+def _local_day(utc_iso: str) -> str:
+    """День по локальному времени (как TG Complete) для метки времени события в UTC"""
+    return datetime.fromisoformat(utc_iso).replace(tzinfo=timezone.utc).astimezone().strftime('%Y-%m-%d')
+
+class FunnelRollup:
+    """Обновляет rollup-таблицы воронки.
+
+    Экземпляр подключается к EventBuffer (aggregators) и к LeadExportQueue (funnel)
+    в main.py; граф анкеты нужен, чтобы сохранять ответы текстом вариантов.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    async def __call__(self, db, batch: Sequence[Tuple[int, str, str, str]]):
+        """Агрегатор EventBuffer: запуски анкеты из пачки событий"""
+        starts: Dict[Tuple[str, str, str, str], int] = {}
+        for _, event, payload, ts in batch:
+            if event != START_EVENT:
+                continue
+            try:
+                utm_data = json.loads(payload) if payload else {}
+            except ValueError:
+                utm_data = {}
+            key = (_local_day(ts),) + utm_key(utm_data)
+            starts[key] = starts.get(key, 0) + 1
+        if starts:
+            await db.executemany(
+                "INSERT INTO utm_funnel_daily(day, utm_source, utm_medium, utm_campaign, starts, completes) "
+                "VALUES(?, ?, ?, ?, ?, 0) "
+                "ON CONFLICT(day, utm_source, utm_medium, utm_campaign) DO UPDATE SET starts = starts + excluded.starts",
+                [key + (count,) for key, count in starts.items()]
+            )
+
+    async def record_complete(self, db, data: Dict[str, Any], day: Optional[str]):
+        """Завершение анкеты и выбранные варианты; вызывается в транзакции записи лида"""
+        if day is None:
+            return
+        key = (day,) + utm_key(data.get('utm_data'))
+        await db.execute(
+            "INSERT INTO utm_funnel_daily(day, utm_source, utm_medium, utm_campaign, starts, completes) "
+            "VALUES(?, ?, ?, ?, 0, 1) "
+            "ON CONFLICT(day, utm_source, utm_medium, utm_campaign) DO UPDATE SET completes = completes + 1",
+            key
+        )
+
+        answers = data.get('answers', {})
+        rows = []
+        for node in self.graph.nodes:
+            if node.id not in answers:
+                continue
+            mask = node.mask(answers[node.id])
+            rows += [key + (node.id, option) for i, option in enumerate(node.options) if mask >> i & 1]
+        if rows:
+            await db.executemany(
+                "INSERT INTO utm_answers_daily(day, utm_source, utm_medium, utm_campaign, question_id, answer, leads) "
+                "VALUES(?, ?, ?, ?, ?, ?, 1) "
+                "ON CONFLICT(day, utm_source, utm_medium, utm_campaign, question_id, answer) "
+                "DO UPDATE SET leads = leads + 1",
+                rows
+            )
+
+class FunnelReport:
+    """Отчёты по rollup-таблицам воронки"""
+
+    def __init__(self, database):
+        self.database = database
+
+    @staticmethod
+    def _filters(since: Optional[str], until: Optional[str]) -> Tuple[str, List[str]]:
+        conditions, params = [], []
+        if since:
+            conditions.append("day >= ?")
+            params.append(since)
+        if until:
+            conditions.append("day <= ?")
+            params.append(until)
+        return (f"WHERE {' AND '.join(conditions)} " if conditions else ""), params
+
+    async def conversion(self, group_by: Sequence[str], since: str = None,
+                         until: str = None) -> List[Dict[str, Any]]:
+        """Запуски, завершения и конверсия start→complete по выбранным UTM-меткам"""
+        columns = [GROUPS[name] for name in group_by]
+        where, params = self._filters(since, until)
+        select = ''.join(f"{column}, " for column in columns)
+        group = f"GROUP BY {', '.join(columns)} " if columns else ""
+        cur = await self.database.conn.execute(
+            f"SELECT {select}SUM(starts), SUM(completes) FROM utm_funnel_daily {where}{group}"
+            f"ORDER BY SUM(completes) DESC",
+            params
+        )
+        result = []
+        for row in await cur.fetchall():
+            starts, completes = row[-2] or 0, row[-1] or 0
+            result.append({
+                'group': dict(zip(group_by, row[:-2])),
+                'starts': starts,
+                'completes': completes,
+                'conversion': completes / starts if starts else None,
+            })
+        return result
+
+    async def answers(self, group_by: Sequence[str], since: str = None, until: str = None,
+                      question_id: str = None) -> List[Dict[str, Any]]:
+        """Сколько завершивших анкету выбрали каждый вариант, по выбранным UTM-меткам"""
+        columns = [GROUPS[name] for name in group_by]
+        where, params = self._filters(since, until)
+        if question_id:
+            where = (where + "AND " if where else "WHERE ") + "question_id = ? "
+            params.append(question_id)
+        select = ''.join(f"{column}, " for column in columns)
+        cur = await self.database.conn.execute(
+            f"SELECT {select}question_id, answer, SUM(leads) FROM utm_answers_daily {where}"
+            f"GROUP BY {select}question_id, answer ORDER BY {select}question_id, SUM(leads) DESC",
+            params
+        )
+        return [
+            {'group': dict(zip(group_by, row[:-3])), 'question_id': row[-3], 'answer': row[-2], 'leads': row[-1]}
+            for row in await cur.fetchall()
+        ]
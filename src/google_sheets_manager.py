@@ -4,46 +4,123 @@
 """
 
 import asyncio
+import json
 import logging
-from typing import Dict, Any, List
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, List, Optional
 from googleapiclient.errors import HttpError
 
 from config import Config
+from lead_stats import lead_day
+from metrics import SHEETS_APPEND_LATENCY, SHEETS_ERRORS
 
 logger = logging.getLogger(__name__)
 
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+# Заголовки столбцов таблицы лидов (порядок совпадает с _format_lead_data)
+SHEET_HEADERS = [
+    'Lead ID',
+    'User ID',
+    'Username',
+    'TG Start',
+    'TG Complete',
+    'Где продаёте',
+    'Как работаете',
+    'FBS заказы в месяц',
+    'FBO/FBW поставки в месяц',
+    'Главная проблема',
+    'Частота проблем',
+    'Потери за 30 дней',
+    'Причины проблем',
+    'Срочность',
+    'Ценник',
+    'UTM Source',
+    'UTM Medium',
+    'UTM Campaign',
+    'UTM Term',
+    'UTM Content'
+]
+
+# Разобранный discovery-документ Sheets v4: один на процесс
+_discovery_document: Optional[Dict[str, Any]] = None
+_discovery_lock = threading.Lock()
+
+def build_sheets_service(credentials):
+    """Создаёт клиент Sheets v4 из discovery-документа, разобранного один раз за процесс.
+
+    googleapiclient.discovery и google.oauth2 импортируются здесь, а не при
+    импорте модуля: это заметная часть времени запуска бота.
+    """
+    global _discovery_document
+    from googleapiclient import discovery_cache
+    from googleapiclient.discovery import build_from_document
+
+    with _discovery_lock:
+        if _discovery_document is None:
+            _discovery_document = json.loads(discovery_cache.get_static_doc('sheets', 'v4'))
+    return build_from_document(_discovery_document, credentials=credentials)
+
+def credentials_from_info(info: Dict[str, Any]):
+    """Учетные данные сервисного аккаунта с доступом к таблицам"""
+    from google.oauth2.service_account import Credentials
+    return Credentials.from_service_account_info(info, scopes=SCOPES)
+
 class GoogleSheetsManager:
     """Класс для работы с Google Sheets API"""
     
     def __init__(self):
-        self.service = None
+        self._service = None
+        self._credentials_data: Optional[Dict[str, Any]] = None
         self.enabled = False
+        # Блокирующие вызовы google-api-python-client выполняются в отдельном потоке,
+        # чтобы не останавливать event loop. httplib2 не потокобезопасен — поэтому один воркер.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sheets')
+        # Граф анкеты (SurveyGraph) для расшифровки ответов; задаётся в main.py
+        self.survey_graph = None
         self._initialize_service()
     
     def _initialize_service(self):
-        """Инициализирует Google Sheets API сервис"""
+        """Проверяет наличие учетных данных; сам клиент создаётся при первом запросе"""
         try:
-            # Получаем учетные данные
-            credentials_data = Config.get_google_credentials()
-            
-            # Создаем credentials объект
-            credentials = Credentials.from_service_account_info(
-                credentials_data,
-                scopes=['https://www.googleapis.com/auth/spreadsheets']
-            )
-            
-            # Создаем сервис
-            self.service = build('sheets', 'v4', credentials=credentials)
+            self._credentials_data = Config.get_google_credentials()
             self.enabled = True
-            
-            logger.info("Google Sheets API сервис инициализирован успешно")
-            
+            logger.info("Google Sheets API включен, клиент будет создан при первом запросе")
         except Exception as e:
             logger.warning(f"Ошибка инициализации Google Sheets API: {e}. Google Sheets отключен.")
             self.enabled = False
     
+    @property
+    def service(self):
+        """Клиент Sheets API; создаётся при первом обращении (в потоке executor'а)"""
+        if self._service is None:
+            try:
+                self._service = build_sheets_service(credentials_from_info(self._credentials_data))
+                logger.info("Google Sheets API сервис инициализирован успешно")
+            except Exception as e:
+                logger.warning(f"Ошибка инициализации Google Sheets API: {e}. Google Sheets отключен.")
+                self.enabled = False
+                raise
+        return self._service
+    
+    @service.setter
+    def service(self, value):
+        self._service = value
+    
+    async def _execute(self, make_request: Callable[[Any], Any]):
+        """Строит и выполняет запрос Google API в потоке executor'а, не блокируя event loop.
+        
+        make_request получает клиент и возвращает запрос: так и первое создание
+        клиента (импорт googleapiclient, разбор discovery) происходит в том же потоке.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: make_request(self.service).execute())
+    
+    def shutdown(self):
+        """Дожидается завершения запросов в работе и останавливает executor"""
+        self._executor.shutdown(wait=True)
+    
     async def save_lead(self, data: Dict[str, Any]) -> bool:
         """Сохраняет данные лида в Google Sheets"""
         if not self.enabled:
@@ -60,21 +137,8 @@ class GoogleSheetsManager:
             row_data = self._format_lead_data(data)
             logger.info(f"Подготовлены данные для записи: {len(row_data)} полей")
             
-            # Добавляем строку в таблицу
-            body = {
-                'values': [row_data]
-            }
-            
             logger.info(f"Отправляем запрос к Google Sheets API...")
-            result = self.service.spreadsheets().values().append(
-                spreadsheetId=Config.SHEET_ID,
-                range='A:Z',  # Добавляем в конец таблицы
-                valueInputOption='RAW',
-                insertDataOption='INSERT_ROWS',
-                body=body
-            ).execute()
-            
-            updated_rows = result.get('updates', {}).get('updatedRows', 0)
+            updated_rows = await self.append_rows([row_data])
             logger.info(f"Данные успешно сохранены в Google Sheets: {updated_rows} строк")
             return True
             
@@ -88,6 +152,34 @@ class GoogleSheetsManager:
             logger.error(f"Тип ошибки: {type(e).__name__}")
             return False
     
+    async def append_rows(self, rows: List[List[Any]]) -> int:
+        """Добавляет несколько строк одним запросом append.
+        
+        Ошибки API не перехватываются — их обрабатывает вызывающий код
+        (например, очередь выгрузки с backoff при превышении квоты).
+        """
+        body = {
+            'values': rows
+        }
+        
+        try:
+            with SHEETS_APPEND_LATENCY.time():
+                result = await self._execute(lambda service: service.spreadsheets().values().append(
+                    spreadsheetId=Config.SHEET_ID,
+                    range='A:Z',  # Добавляем в конец таблицы
+                    valueInputOption='RAW',
+                    insertDataOption='INSERT_ROWS',
+                    body=body
+                ))
+        except HttpError as e:
+            SHEETS_ERRORS.inc(status=e.resp.status)
+            raise
+        except Exception as e:
+            SHEETS_ERRORS.inc(status=type(e).__name__)
+            raise
+        
+        return result.get('updates', {}).get('updatedRows', 0)
+    
     def _format_lead_data(self, data: Dict[str, Any]) -> List[Any]:
         """Форматирует данные лида для записи в Google Sheets"""
         # Базовые данные
@@ -99,13 +191,16 @@ class GoogleSheetsManager:
             data.get('tg_complete', ''),       # TG Complete
         ]
         
-        # Ответы на вопросы (в порядке из конфигурации)
+        # Ответы на вопросы (в порядке из конфигурации); в FSM они хранятся индексами
         answers = data.get('answers', {})
-        for question in self._get_question_order():
-            answer = answers.get(question, 'Не указано')
-            if isinstance(answer, list):
-                answer = ', '.join(answer)
-            row_data.append(answer)
+        if self.survey_graph is not None:
+            row_data.extend(text for _, text in self.survey_graph.decode_answers(answers))
+        else:
+            for question in self._get_question_order():
+                answer = answers.get(question, 'Не указано')
+                if isinstance(answer, list):
+                    answer = ', '.join(answer)
+                row_data.append(answer)
         
         # UTM-параметры
         utm_data = data.get('utm_data', {})
@@ -139,47 +234,25 @@ class GoogleSheetsManager:
             return False
         
         try:
-            # Заголовки для таблицы
-            headers = [
-                'Lead ID',
-                'User ID',
-                'Username', 
-                'TG Start',
-                'TG Complete',
-                'Где продаёте',
-                'Как работаете',
-                'FBS заказы в месяц',
-                'FBO/FBW поставки в месяц',
-                'Главная проблема',
-                'Частота проблем',
-                'Потери за 30 дней',
-                'Причины проблем',
-                'Срочность',
-                'Ценник',
-                'UTM Source',
-                'UTM Medium',
-                'UTM Campaign',
-                'UTM Term',
-                'UTM Content'
-            ]
+            headers = SHEET_HEADERS
             
             # Очищаем существующие данные
-            self.service.spreadsheets().values().clear(
+            await self._execute(lambda service: service.spreadsheets().values().clear(
                 spreadsheetId=Config.SHEET_ID,
                 range='A:Z'
-            ).execute()
+            ))
             
             # Добавляем заголовки
             body = {
                 'values': [headers]
             }
             
-            result = self.service.spreadsheets().values().update(
+            result = await self._execute(lambda service: service.spreadsheets().values().update(
                 spreadsheetId=Config.SHEET_ID,
                 range='A1',
                 valueInputOption='RAW',
                 body=body
-            ).execute()
+            ))
             
             # Форматируем заголовки (делаем их жирными)
             requests = [
@@ -208,10 +281,10 @@ class GoogleSheetsManager:
                 }
             ]
             
-            self.service.spreadsheets().batchUpdate(
+            await self._execute(lambda service: service.spreadsheets().batchUpdate(
                 spreadsheetId=Config.SHEET_ID,
                 body={'requests': requests}
-            ).execute()
+            ))
             
             logger.info(f"Заголовки успешно настроены: {result.get('updatedCells', 0)} ячеек")
             return True
@@ -223,44 +296,22 @@ class GoogleSheetsManager:
             logger.error(f"Неожиданная ошибка при настройке заголовков: {e}")
             return False
     
-    async def get_stats(self) -> Dict[str, int]:
-        """Получает статистику лидов"""
+    async def count_leads_by_day(self) -> Dict[str, int]:
+        """Число строк лидов в таблице по дню TG Complete (для сверки статистики).
+
+        Читает только столбец TG Complete, а не весь диапазон A:Z.
+        """
         if not self.enabled:
-            return {'total_leads': 0, 'today_leads': 0}
+            raise RuntimeError("Google Sheets отключен")
         
-        try:
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=Config.SHEET_ID,
-                range='A:Z'
-            ).execute()
-            
-            values = result.get('values', [])
-            if len(values) <= 1:  # Только заголовки
-                return {'total_leads': 0, 'today_leads': 0}
-            
-            # Подсчитываем общее количество лидов (исключая заголовок)
-            total_leads = len(values) - 1
-            
-            # Подсчитываем лиды за сегодня
-            from datetime import datetime
-            today = datetime.now().strftime('%Y-%m-%d')
-            today_leads = 0
-            
-            for row in values[1:]:  # Пропускаем заголовок
-                if len(row) > 4:  # Проверяем, что есть поле с датой завершения
-                    try:
-                        row_date = datetime.fromisoformat(row[4].split()[0]).strftime('%Y-%m-%d')
-                        if row_date == today:
-                            today_leads += 1
-                    except (ValueError, IndexError):
-                        continue
-            
-            return {
-                'total_leads': total_leads,
-                'today_leads': today_leads
-            }
-            
-        except Exception as e:
-            logger.error(f"Ошибка при получении статистики: {e}")
-            return {'total_leads': 0, 'today_leads': 0}
-
+        result = await self._execute(lambda service: service.spreadsheets().values().get(
+            spreadsheetId=Config.SHEET_ID,
+            range='E2:E'  # TG Complete без заголовка
+        ))
+        
+        days: Dict[str, int] = {}
+        for row in result.get('values', []):
+            day = lead_day(row[0]) if row else None
+            if day is not None:
+                days[day] = days.get(day, 0) + 1
+        return days
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Клавиатуры анкеты, собранные один раз при запуске
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def build_keyboard(rows: Iterable[Iterable[Tuple[str, str]]]) -> InlineKeyboardMarkup:
+    """Собирает клавиатуру из строк пар (текст, callback_data)"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=text, callback_data=callback_data) for text, callback_data in row]
+        for row in rows
+    ])
+
+class SurveyKeyboards:
+    """Предсобранные клавиатуры анкеты.
+
+    Клавиатуры приветствия, финала и вопросов с одиночным выбором создаются
+    при запуске и переиспользуются (объекты aiogram неизменяемые). Варианты
+    клавиатур множественного выбора кэшируются по битовой маске выбранных
+    вариантов в ограниченном LRU-кэше, кнопки вариантов тоже создаются один раз.
+    """
+
+    def __init__(self, config: Dict[str, Any], cache_size: int = None):
+        self.cache_size = cache_size or Config.KEYBOARD_CACHE_SIZE
+
+        self.welcome = build_keyboard(
+            [(text, f"welcome:{i}")] for i, text in enumerate(config['welcome']['buttons'])
+        )
+        self.final = build_keyboard(
+            [(text, f"final:{i}")] for i, text in enumerate(config['final']['buttons'])
+        )
+
+        self._single: Dict[str, InlineKeyboardMarkup] = {}
+        # Для множественного выбора: кнопки (не выбран, выбран) по каждому варианту и кнопка "Далее"
+        self._multi_buttons: Dict[str, Tuple[List[Tuple[InlineKeyboardButton, InlineKeyboardButton]], InlineKeyboardButton]] = {}
+        self._multi_cache: "OrderedDict[Tuple[str, int], InlineKeyboardMarkup]" = OrderedDict()
+
+        for question in config['questions']:
+            question_id = question['id']
+            if question['type'] == 'multi':
+                buttons = [
+                    tuple(
+                        InlineKeyboardButton(text=f"{mark} {option}", callback_data=f"answer:{question_id}:{i}")
+                        for mark in ('⬜', '✅')
+                    )
+                    for i, option in enumerate(question['options'])
+                ]
+                next_button = InlineKeyboardButton(text="➡️ Далее", callback_data=f"next:{question_id}")
+                self._multi_buttons[question_id] = (buttons, next_button)
+            else:
+                # Используем индекс вместо полного текста для избежания проблем с символами
+                self._single[question_id] = build_keyboard(
+                    [(option, f"answer:{question_id}:{i}")] for i, option in enumerate(question['options'])
+                )
+
+    def question(self, question: Dict[str, Any], selected_mask: int = 0) -> InlineKeyboardMarkup:
+        """Клавиатура вопроса; для множественного выбора — с отметками по маске выбранных вариантов"""
+        question_id = question['id']
+        keyboard = self._single.get(question_id)
+        if keyboard is not None:
+            return keyboard
+
+        cache_key = (question_id, selected_mask)
+        keyboard = self._multi_cache.get(cache_key)
+        if keyboard is not None:
+            self._multi_cache.move_to_end(cache_key)
+            return keyboard
+
+        buttons, next_button = self._multi_buttons[question_id]
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [pair[(selected_mask >> i) & 1]] for i, pair in enumerate(buttons)
+        ] + [[next_button]])
+
+        self._multi_cache[cache_key] = keyboard
+        while len(self._multi_cache) > self.cache_size:
+            self._multi_cache.popitem(last=False)
+        return keyboard
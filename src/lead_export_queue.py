@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Надёжная очередь (outbox) выгрузки лидов в Google Sheets пачками
+"""
+
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+from googleapiclient.errors import HttpError
+
+from config import Config
+from lead_stats import lead_day, record_lead
+from lead_store import save_lead
+
+logger = logging.getLogger(__name__)
+
+# HTTP статусы, при которых запрос стоит повторить позже (квота, временные сбои)
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Ошибки доступа и настройки (таблица не расшарена, неверный SHEET_ID, отозванные
+# учётные данные): исправляются без изменения строк, поэтому тоже повторяем с backoff
+CONFIG_ERROR_STATUSES = {401, 403, 404}
+
+class LeadExportQueue:
+    """Очередь выгрузки лидов с локальным outbox в SQLite.
+
+    Каждый лид сначала записывается в таблицу lead_outbox (одна локальная транзакция
+    вместе со счётчиком лидов за день, копией в таблице leads и rollup воронки),
+    а фоновая задача выгружает накопленные строки одним multi-row append и помечает
+    их доставленными. Строки, не выгруженные из-за сбоев или перезапуска, остаются
+    в статусе pending и отправляются повторно. Доставка — «как минимум один раз».
+
+    Если Google Sheets отклоняет пачку как некорректную (HTTP 400), она делится
+    пополам, пока не останется отклонённая строка: в статус failed переходит только
+    она. Такие строки возвращаются в очередь при старте и командой /requeue.
+    """
+
+    def __init__(self, sheets_manager, database, batch_size: int = None,
+                 flush_interval: float = None, max_backoff: float = None):
+        self.sheets_manager = sheets_manager
+        self.database = database
+        self.batch_size = batch_size or Config.SHEETS_BATCH_SIZE
+        self.flush_interval = flush_interval or Config.SHEETS_FLUSH_INTERVAL
+        self.max_backoff = max_backoff or Config.SHEETS_MAX_BACKOFF
+
+        # Rollup воронки по UTM (FunnelRollup); задаётся в main.py
+        self.funnel = None
+
+        # В режиме шардирования каждый воркер выгружает только лиды своих пользователей
+        self.shard_index = 0
+        self.shard_count = 1
+
+        self._pending = 0
+        self._waiters: Dict[int, asyncio.Future] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._backoff = 0.0
+        self._retry_at = 0.0
+
+    async def start(self):
+        """Подсчитывает невыгруженные лиды в outbox и запускает фоновую выгрузку"""
+        # Event создаём внутри работающего loop (в Python 3.9 он привязывается к loop при создании)
+        self._wakeup = asyncio.Event()
+
+        # Ещё одна попытка для строк, отклонённых до перезапуска (например, до исправления таблицы)
+        requeued = await self.requeue_failed(all_shards=False)
+        if requeued:
+            logger.info(f"Отклонённые ранее лиды возвращены в очередь: {requeued}")
+
+        self._pending = await self._count_pending()
+        if self._pending:
+            logger.info(f"В outbox найдено невыгруженных лидов: {self._pending}")
+
+        if self._exporting_enabled():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Очередь выгрузки лидов запущена: до {self.batch_size} строк, каждые {self.flush_interval} с")
+        else:
+            logger.warning("Google Sheets отключен. Лиды будут накапливаться в outbox.")
+
+    async def put(self, data: Dict[str, Any]) -> asyncio.Future:
+        """Сохраняет лид в outbox. Возвращает future с результатом первой попытки выгрузки"""
+        future = asyncio.get_running_loop().create_future()
+        row_data = self.sheets_manager._format_lead_data(data)
+
+        async with self.database.transaction() as db:
+            cur = await db.execute(
+                "INSERT INTO lead_outbox(lead_id, user_id, row_json, status, attempts, created_at) VALUES(?,?,?,?,?,?)",
+                (data.get('lead_id'), data.get('user_id'), json.dumps(row_data, ensure_ascii=False),
+                 'pending', 0, datetime.utcnow().isoformat())
+            )
+            day = lead_day(data.get('tg_complete', ''))
+            await record_lead(db, day)
+            await save_lead(db, data, row_data)
+            if self.funnel is not None:
+                await self.funnel.record_complete(db, data, day)
+        self._pending += 1
+
+        if not self._exporting_enabled():
+            future.set_result(False)
+            return future
+
+        self._waiters[cur.lastrowid] = future
+        if self._pending >= self.batch_size:
+            self._wakeup.set()
+        return future
+
+    async def stop(self):
+        """Останавливает фоновую выгрузку и пытается отправить всё, что осталось"""
+        if self._task:
+            # Не отменяем задачу посреди append: строки уже ушли бы в таблицу,
+            # но остались бы pending и были бы отправлены повторно
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+            # При остановке не ждём окончания backoff — это последняя попытка
+            while self._pending:
+                if not await self._flush_batch():
+                    break
+
+        if self._pending:
+            logger.warning(f"В outbox остались невыгруженные лиды: {self._pending}. Они будут отправлены после перезапуска.")
+        self._resolve(list(self._waiters), False)
+
+    async def requeue_failed(self, all_shards: bool = True) -> int:
+        """Возвращает отклонённые строки (status='failed') в очередь. Возвращает их количество"""
+        condition, params = "", ()
+        if not all_shards:
+            condition, params = " AND ABS(COALESCE(user_id, 0)) % ? = ?", (self.shard_count, self.shard_index)
+        async with self.database.transaction() as db:
+            cur = await db.execute(f"UPDATE lead_outbox SET status='pending' WHERE status='failed'{condition}", params)
+            requeued = cur.rowcount
+        if requeued and self._wakeup:
+            self._pending = await self._count_pending()
+            self._wakeup.set()
+        return requeued
+
+    async def _count_pending(self) -> int:
+        cur = await self.database.conn.execute(
+            "SELECT COUNT(*) FROM lead_outbox WHERE status='pending' AND ABS(COALESCE(user_id, 0)) % ? = ?",
+            (self.shard_count, self.shard_index)
+        )
+        return (await cur.fetchone())[0]
+
+    def _exporting_enabled(self) -> bool:
+        return self.sheets_manager.enabled and bool(Config.SHEET_ID)
+
+    async def _run(self):
+        """Цикл выгрузки: по таймеру или при накоплении batch_size строк"""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                if not self._pending:
+                    # Строки могли вернуть в очередь командой /requeue в другом воркере
+                    self._pending = await self._count_pending()
+                while self._pending and not self._stopping and time.monotonic() >= self._retry_at:
+                    if not await self._flush_batch():
+                        break
+                    # Неполную пачку отправляем только один раз за интервал
+                    if self._pending < self.batch_size:
+                        break
+            except Exception as e:
+                logger.error(f"Неожиданная ошибка в очереди выгрузки лидов: {e}")
+
+    async def _flush_batch(self) -> bool:
+        """Отправляет одну пачку из outbox. Возвращает False, если выгрузку нужно отложить"""
+        cur = await self.database.conn.execute(
+            "SELECT id, row_json FROM lead_outbox WHERE status='pending' AND ABS(COALESCE(user_id, 0)) % ? = ? "
+            "ORDER BY id LIMIT ?",
+            (self.shard_count, self.shard_index, self.batch_size)
+        )
+        batch: List[Tuple[int, str]] = await cur.fetchall()
+        if not batch:
+            self._pending = 0
+            return True
+
+        ids = [row_id for row_id, _ in batch]
+        rows = [json.loads(row_json) for _, row_json in batch]
+        return await self._send(ids, rows)
+
+    async def _send(self, ids: List[int], rows: List[List[Any]]) -> bool:
+        """Выгружает строки одним append. Возвращает False, если выгрузку нужно отложить"""
+        try:
+            updated_rows = await self.sheets_manager.append_rows(rows)
+        except HttpError as e:
+            status = e.resp.status
+            if status in RETRYABLE_STATUSES:
+                await self._mark_attempt(ids, f"HTTP {status}")
+                self._schedule_retry(f"HTTP {status}")
+                return False
+            if status in CONFIG_ERROR_STATUSES:
+                logger.error(f"Нет доступа к таблице Google Sheets (HTTP {status}): проверьте SHEET_ID, "
+                             f"доступ сервисного аккаунта и учётные данные. {e}")
+                await self._mark_attempt(ids, f"HTTP {status}: {e}")
+                self._schedule_retry(f"HTTP {status}")
+                return False
+            if status == 400 and len(ids) > 1:
+                # Пачку отклонила одна строка: делим, чтобы остальные выгрузились
+                middle = len(ids) // 2
+                return (await self._send(ids[:middle], rows[:middle])
+                        and await self._send(ids[middle:], rows[middle:]))
+            # Строку отклонил сам запрос — повтор не поможет, оставляем её в outbox как failed
+            logger.error(f"Ошибка Google Sheets API: {e}")
+            logger.error(f"HTTP статус: {status}")
+            await self._mark_attempt(ids, f"HTTP {status}: {e}", status='failed')
+            return True
+        except (OSError, asyncio.TimeoutError) as e:
+            await self._mark_attempt(ids, f"{type(e).__name__}: {e}")
+            self._schedule_retry(f"{type(e).__name__}: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Неожиданная ошибка при выгрузке в Google Sheets: {e}")
+            logger.error(f"Тип ошибки: {type(e).__name__}")
+            await self._mark_attempt(ids, f"{type(e).__name__}: {e}")
+            self._schedule_retry(type(e).__name__)
+            return False
+
+        async with self.database.transaction() as db:
+            await db.execute(
+                f"UPDATE lead_outbox SET status='delivered', attempts=attempts+1, delivered_at=? "
+                f"WHERE id IN ({','.join('?' * len(ids))})",
+                (datetime.utcnow().isoformat(), *ids)
+            )
+        self._pending = max(self._pending - len(ids), 0)
+
+        logger.info(f"Выгружено в Google Sheets одним запросом: {updated_rows} строк")
+        self._backoff = 0.0
+        self._resolve(ids, True)
+        return True
+
+    async def _mark_attempt(self, ids: List[int], error: str, status: str = 'pending'):
+        """Фиксирует неудачную попытку выгрузки в outbox"""
+        async with self.database.transaction() as db:
+            await db.execute(
+                f"UPDATE lead_outbox SET status=?, attempts=attempts+1, last_error=? "
+                f"WHERE id IN ({','.join('?' * len(ids))})",
+                (status, error, *ids)
+            )
+        if status != 'pending':
+            self._pending = max(self._pending - len(ids), 0)
+        # Лид уже сохранён локально — сообщаем результат первой попытки, не дожидаясь повторов
+        self._resolve(ids, False)
+
+    def _schedule_retry(self, reason: str):
+        """Экспоненциальный backoff после ошибки квоты или временного сбоя"""
+        self._backoff = min(self._backoff * 2 if self._backoff else self.flush_interval, self.max_backoff)
+        self._retry_at = time.monotonic() + self._backoff
+        logger.warning(f"Выгрузка в Google Sheets отложена на {self._backoff:.0f} с ({reason}), в outbox: {self._pending}")
+
+    def _resolve(self, ids: List[int], success: bool):
+        """Сообщает результат выгрузки ожидающим"""
+        for row_id in ids:
+            future = self._waiters.pop(row_id, None)
+            if future and not future.done():
+                future.set_result(success)
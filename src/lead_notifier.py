@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Уведомления о новых лидах в приватный канал с режимом сводки при всплесках
+"""
+
+import asyncio
+import html
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from config import Config
+from rate_limiter import low_priority
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины текста сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+class NotificationRenderer:
+    """Шаблон уведомления, собранный из графа анкеты один раз при запуске"""
+
+    def __init__(self, graph):
+        self.graph = graph
+        # Подписи вопросов экранируются и форматируются заранее
+        self._answer_prefixes = [
+            f"• <b>{html.escape(node.question['question'])}</b>: " for node in graph.nodes
+        ]
+
+    def render(self, data: Dict[str, Any], sheets_success: bool) -> str:
+        """Полное уведомление об одном лиде"""
+        parts = [
+            "🎉 <b>Новый лид заполнил анкету!</b>\n\n",
+            f"📋 <b>Lead ID:</b> <code>{html.escape(str(data['lead_id']))}</code>\n",
+            f"👤 <b>Пользователь:</b> {self._user(data)}\n",
+            f"📅 <b>Время заполнения:</b> {self._complete_time(data)}\n",
+            f"💾 <b>Google Sheets:</b> {'✅ Сохранено' if sheets_success else '⏳ В очереди'}\n\n",
+            "📊 <b>Ответы:</b>\n",
+        ]
+        for prefix, (_, answer) in zip(self._answer_prefixes, self.graph.decode_answers(data['answers'])):
+            parts += (prefix, html.escape(answer), "\n")
+
+        utm_data = data.get('utm_data', {})
+        if utm_data:
+            parts.append("\n🏷 <b>UTM-параметры:</b>\n")
+            for key, value in utm_data.items():
+                parts += ("• <b>", html.escape(str(key)), ":</b> ", html.escape(str(value)), "\n")
+
+        if sheets_success:
+            parts.append("\n✅ <b>Данные успешно загружены в Google Sheets!</b>")
+        else:
+            parts.append("\n⏳ <b>Google Sheets недоступен — лид сохранён локально в outbox.</b>")
+        return ''.join(parts)
+
+    def render_digest(self, leads: List[Tuple[Dict[str, Any], bool]], interval: float) -> str:
+        """Сводка по нескольким лидам в одном сообщении не длиннее MESSAGE_LIMIT"""
+        header = f"📥 <b>Новых лидов за {int(interval)} с: {len(leads)}</b>\n\n"
+        footer = "\n\nПолные ответы — в Google Sheets."
+        lines: List[str] = []
+        # Оставляем место под строку "… и ещё N"
+        length = len(header) + len(footer) + len("\n… и ещё 100000")
+        for shown, (data, sheets_success) in enumerate(leads):
+            line = self._digest_line(data, sheets_success)
+            if length + len(line) + 1 > MESSAGE_LIMIT:
+                lines.append(f"… и ещё {len(leads) - shown}")
+                break
+            lines.append(line)
+            length += len(line) + 1
+        return header + '\n'.join(lines) + footer
+
+    def _digest_line(self, data: Dict[str, Any], sheets_success: bool) -> str:
+        source = data.get('utm_data', {}).get('utm_source')
+        line = f"{'✅' if sheets_success else '⏳'} {self._user(data)}"
+        if source:
+            line += f" · {html.escape(str(source))}"
+        return line
+
+    @staticmethod
+    def _user(data: Dict[str, Any]) -> str:
+        return f"@{html.escape(str(data['username']))} (ID: {data['user_id']})"
+
+    @staticmethod
+    def _complete_time(data: Dict[str, Any]) -> str:
+        try:
+            return datetime.fromisoformat(data['tg_complete']).strftime('%d.%m.%Y %H:%M:%S')
+        except (KeyError, TypeError, ValueError):
+            return html.escape(str(data.get('tg_complete', '')))
+
+class LeadNotifier:
+    """Отправляет уведомления о лидах в приватный канал.
+
+    Пока лидов за интервал не больше digest_threshold, каждый лид уходит
+    отдельным сообщением. При всплеске уведомления копятся и раз в интервал
+    отправляются одной сводкой, чтобы не упираться в лимит публикаций канала.
+    """
+
+    def __init__(self, bot, renderer: NotificationRenderer, channel_id: str = None,
+                 digest_threshold: int = None, digest_interval: float = None):
+        self.bot = bot
+        self.renderer = renderer
+        self.channel_id = channel_id or Config.PRIVATE_CHANNEL_ID
+        self.digest_threshold = Config.NOTIFY_DIGEST_THRESHOLD if digest_threshold is None else digest_threshold
+        self.digest_interval = digest_interval or Config.NOTIFY_DIGEST_INTERVAL
+
+        self._recent: Deque[float] = deque()
+        self._digest: List[Tuple[Dict[str, Any], bool]] = []
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    async def start(self):
+        """Запускает периодическую отправку сводок"""
+        if self.digest_threshold > 0:
+            # Event создаём внутри работающего loop (в Python 3.9 он привязывается к loop при создании)
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает цикл и отправляет накопленную сводку"""
+        if self._task:
+            # Не отменяем задачу посреди отправки: сводка уже вынута из _digest
+            # и при отмене потерялась бы
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self._flush_digest()
+
+    async def notify(self, data: Dict[str, Any], sheets_success: bool):
+        """Уведомление о лиде: сразу или в ближайшей сводке, если лидов слишком много"""
+        if not self.channel_id:
+            logger.warning("PRIVATE_CHANNEL_ID не настроен. Уведомление не отправлено.")
+            return
+
+        now = time.monotonic()
+        self._recent.append(now)
+        while self._recent[0] < now - self.digest_interval:
+            self._recent.popleft()
+
+        # Пока сводка не отправлена, новые лиды идут в неё же — порядок сохраняется
+        if self._task and (self._digest or len(self._recent) > self.digest_threshold):
+            if not self._digest:
+                logger.info(f"Много лидов за {self.digest_interval} с — уведомления собираются в сводку")
+            self._digest.append((data, sheets_success))
+            return
+
+        await self._send(self.renderer.render(data, sheets_success))
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.digest_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self._flush_digest()
+            except Exception as e:
+                logger.error(f"Ошибка отправки сводки лидов: {e}")
+
+    async def _flush_digest(self):
+        if not self._digest:
+            return
+        leads, self._digest = self._digest, []
+        await self._send(self.renderer.render_digest(leads, self.digest_interval))
+        logger.info(f"Отправлена сводка по лидам: {len(leads)}")
+
+    async def _send(self, text: str):
+        try:
+            with low_priority():
+                await self.bot.send_message(self.channel_id, text, parse_mode='HTML')
+            logger.info(f"Уведомление отправлено в канал {self.channel_id}")
+        except Exception as e:
+            logger.error(f"Ошибка отправки уведомления: {e}")
+            logger.error(f"Детали ошибки: {type(e).__name__}")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Счётчики лидов по дням для команды /stats
+
+Счётчик дня увеличивается в той же транзакции, что и запись лида в
+outbox, поэтому /stats читает пару строк lead_stats_daily вместо выгрузки
+всей таблицы Google Sheets. Сверка с таблицей выполняется только по
+запросу (reconcile).
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# День лида по TG Complete (локальное время, как в таблице): "YYYY-MM-DD"
+_DAY_SQL = "substr(json_extract(row_json, '$[4]'), 1, 10)"
+
+def lead_day(tg_complete) -> Optional[str]:
+    """День завершения анкеты из ISO-времени TG Complete или None, если его нет"""
+    try:
+        return datetime.fromisoformat(str(tg_complete).strip()[:10]).strftime('%Y-%m-%d')
+    except ValueError:
+        return None
+
+async def record_lead(db, day: Optional[str]):
+    """Увеличивает счётчик дня; вызывается внутри транзакции записи лида"""
+    if day is None:
+        return
+    await db.execute(
+        "INSERT INTO lead_stats_daily(day, leads) VALUES(?, 1) "
+        "ON CONFLICT(day) DO UPDATE SET leads = leads + 1",
+        (day,)
+    )
+
+class LeadStats:
+    """Статистика лидов из счётчиков по дням в bot.db"""
+
+    def __init__(self, database):
+        self.database = database
+
+    async def get(self, today: str = None) -> Dict[str, int]:
+        """Всего лидов и лидов за сегодня"""
+        today = today or datetime.now().strftime('%Y-%m-%d')
+        cur = await self.database.conn.execute(
+            "SELECT COALESCE(SUM(leads), 0), COALESCE(SUM(CASE WHEN day = ? THEN leads END), 0) "
+            "FROM lead_stats_daily",
+            (today,)
+        )
+        total_leads, today_leads = await cur.fetchone()
+        return {'total_leads': total_leads, 'today_leads': today_leads}
+
+    async def reconcile(self, sheets_manager) -> Dict[str, int]:
+        """Пересчитывает счётчики по таблице Google Sheets.
+
+        Лиды, которые ещё не выгружены (или выгружены уже после чтения
+        таблицы), берутся из outbox. Возвращает общее число лидов до и после.
+        """
+        before = (await self.get())['total_leads']
+        # Граница по delivered_at: строки, выгруженные позже, в прочитанной таблице отсутствуют
+        read_at = datetime.utcnow().isoformat()
+        days = await sheets_manager.count_leads_by_day()
+
+        async with self.database.transaction() as db:
+            # sqlite3 открывает транзакцию только на DELETE: без BEGIN IMMEDIATE лид,
+            # записанный другим воркером между SELECT и перезаписью, пропал бы из счётчиков
+            await db.execute("BEGIN IMMEDIATE")
+            cur = await db.execute(
+                f"SELECT {_DAY_SQL} AS day, COUNT(*) FROM lead_outbox "
+                f"WHERE status != 'delivered' OR delivered_at >= ? GROUP BY day",
+                (read_at,)
+            )
+            for day, count in await cur.fetchall():
+                if lead_day(day) is not None:
+                    days[day] = days.get(day, 0) + count
+
+            await db.execute("DELETE FROM lead_stats_daily")
+            await db.executemany(
+                "INSERT INTO lead_stats_daily(day, leads) VALUES(?, ?)",
+                sorted(days.items())
+            )
+
+        after = sum(days.values())
+        logger.info(f"Статистика лидов сверена с Google Sheets: было {before}, стало {after}")
+        return {'before': before, 'after': after}
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Локальная копия завершённых лидов для админских команд /leads и /resend
+
+Лид записывается в таблицу leads в той же транзакции, что и в outbox.
+Выборки идут по индексам с keyset-пагинацией (id < курсора), поэтому
+команда читает только строки, которые покажет, — и с фильтрами по
+utm_source и дню тоже.
+"""
+
+import json
+from typing import Any, Dict, List, Optional
+
+from lead_stats import lead_day
+
+_COLUMNS = "id, lead_id, user_id, username, completed_at, utm_source, row_json, data_json"
+
+async def save_lead(db, data: Dict[str, Any], row: List[Any]):
+    """Сохраняет лид; вызывается внутри транзакции записи в outbox"""
+    utm_data = data.get('utm_data', {})
+    await db.execute(
+        "INSERT OR IGNORE INTO leads(lead_id, user_id, username, completed_at, day, "
+        "utm_source, utm_medium, utm_campaign, row_json, data_json) "
+        "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (data.get('lead_id'), data.get('user_id'), data.get('username'), data.get('tg_complete'),
+         lead_day(data.get('tg_complete', '')),
+         utm_data.get('utm_source') or None, utm_data.get('utm_medium') or None, utm_data.get('utm_campaign') or None,
+         json.dumps(row, ensure_ascii=False), json.dumps(data, ensure_ascii=False, default=str))
+    )
+
+def _record(row) -> Dict[str, Any]:
+    record = dict(zip(('id', 'lead_id', 'user_id', 'username', 'completed_at', 'utm_source'), row[:6]))
+    record['row'] = json.loads(row[6])
+    # У лидов, перенесённых из outbox при миграции, полных данных нет — только строка таблицы
+    record['data'] = json.loads(row[7]) if row[7] else None
+    return record
+
+class LeadStore:
+    """Чтение последних лидов из таблицы leads"""
+
+    def __init__(self, database):
+        self.database = database
+
+    async def recent(self, limit: int, before_id: Optional[int] = None,
+                     utm_source: Optional[str] = None, day: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Лиды от новых к старым, начиная с id < before_id"""
+        conditions, params = [], []
+        if before_id is not None:
+            conditions.append("id < ?")
+            params.append(before_id)
+        # Индексы: (utm_source, id), (day, id) и (day, utm_source, id) для обоих фильтров
+        if utm_source is not None:
+            conditions.append("utm_source = ?")
+            params.append(utm_source)
+        if day is not None:
+            conditions.append("day = ?")
+            params.append(day)
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        cur = await self.database.conn.execute(
+            f"SELECT {_COLUMNS} FROM leads {where}ORDER BY id DESC LIMIT ?",
+            (*params, limit)
+        )
+        return [_record(row) for row in await cur.fetchall()]
+
+    async def get(self, lead_id: str) -> Optional[Dict[str, Any]]:
+        """Лид по lead_id"""
+        cur = await self.database.conn.execute(f"SELECT {_COLUMNS} FROM leads WHERE lead_id = ?", (lead_id,))
+        row = await cur.fetchone()
+        return _record(row) if row else None
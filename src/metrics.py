@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Метрики бота в текстовом формате Prometheus
+
+Счётчики и гистограммы хранятся в памяти процесса и отдаются по HTTP
+(GET /metrics) локальным aiohttp-сервером. Отдельная зависимость
+prometheus_client не нужна: формат экспозиции простой, а aiohttp уже есть.
+"""
+
+import bisect
+import functools
+import inspect
+import logging
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from aiogram import BaseMiddleware
+from aiohttp import web
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        REGISTRY.register(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+    async def collect(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    """Монотонный счётчик"""
+
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self._values: Dict[Tuple[str, ...], float] = {}
+        super().__init__(name, documentation, labelnames)
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    async def collect(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in self._values.items()
+        ]
+
+class Histogram(_Metric):
+    """Гистограмма длительностей с фиксированными границами корзин"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # по набору меток: [счётчики корзин..., +Inf], сумма
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        record = self._values.get(key)
+        if record is None:
+            record = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        counts, total = record
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет длительность блока"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def timed(self, **labels):
+        """Декоратор корутины, замеряющий длительность её выполнения"""
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.time(**labels):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    async def collect(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+class Gauge(_Metric):
+    """Значение, вычисляемое при каждом запросе метрик (функция может быть корутиной)"""
+
+    type_name = 'gauge'
+
+    def __init__(self, name: str, documentation: str,
+                 function: Callable[[], Union[float, Awaitable[float]]]):
+        self.function = function
+        super().__init__(name, documentation)
+
+    async def collect(self) -> List[str]:
+        try:
+            value = self.function()
+            if inspect.isawaitable(value):
+                value = await value
+        except Exception as e:
+            logger.warning(f"Не удалось вычислить метрику {self.name}: {e}")
+            return []
+        return [f"{self.name} {_format_value(value)}"]
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика уже зарегистрирована: {metric.name}")
+        self._metrics[metric.name] = metric
+
+    async def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.header()
+            lines += await metric.collect()
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+# Метрики, которые пишут модули бота
+HANDLER_LATENCY = Histogram('bot_handler_duration_seconds', 'Handler duration', ['handler'])
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Handler exceptions', ['handler'])
+SHEETS_APPEND_LATENCY = Histogram('bot_sheets_append_duration_seconds', 'Google Sheets append request duration')
+SHEETS_ERRORS = Counter('bot_sheets_errors_total', 'Google Sheets request errors', ['status'])
+SQLITE_LOCK_WAIT = Histogram('bot_sqlite_lock_wait_seconds', 'Wait for the bot.db write lock')
+SQLITE_TRANSACTION_LATENCY = Histogram('bot_sqlite_transaction_duration_seconds', 'bot.db write transaction duration')
+
+class HandlerLatencyMiddleware(BaseMiddleware):
+    """Inner middleware: длительность и ошибки каждого обработчика по имени функции"""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get('handler')
+        name = getattr(getattr(handler_object, 'callback', None), '__name__', 'unknown')
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, handler=name)
+
+class MetricsServer:
+    """Локальный HTTP-сервер метрик: GET /metrics"""
+
+    def __init__(self, host: str = None, port: int = None, registry: Registry = REGISTRY):
+        self.host = host or Config.METRICS_HOST
+        self.port = Config.METRICS_PORT if port is None else port
+        self.registry = registry
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self):
+        """Запускает сервер, если задан METRICS_PORT"""
+        if not self.port:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        body = await self.registry.render()
+        return web.Response(body=body.encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
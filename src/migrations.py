@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Миграции схемы базы данных bot.db
+
+Версия схемы хранится в PRAGMA user_version. Каждая миграция выполняется
+в отдельной транзакции один раз; чтобы добавить таблицу или индекс,
+допишите новую функцию в конец списка MIGRATIONS.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+async def _initial_schema(db):
+    """Базовые таблицы: события, предзаписи, настройки, outbox лидов"""
+    # IF NOT EXISTS — базы, созданные до появления миграций, уже содержат эти таблицы
+    await db.execute("""CREATE TABLE IF NOT EXISTS events(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER, event TEXT, payload TEXT, ts TEXT
+    )""")
+    await db.execute("""CREATE TABLE IF NOT EXISTS prereg(
+        user_id INTEGER PRIMARY KEY,
+        code TEXT, tariff TEXT, valid_to TEXT, created_at TEXT
+    )""")
+    await db.execute("""CREATE TABLE IF NOT EXISTS settings(
+        key TEXT PRIMARY KEY, value TEXT
+    )""")
+    await db.execute("""CREATE TABLE IF NOT EXISTS lead_outbox(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        lead_id TEXT, user_id INTEGER, row_json TEXT,
+        status TEXT, attempts INTEGER, last_error TEXT,
+        created_at TEXT, delivered_at TEXT
+    )""")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_lead_outbox_status ON lead_outbox(status, id)")
+
+async def _prereg_place(db):
+    """Хранимый номер в очереди предзаписи, заполненный по порядку создания"""
+    cur = await db.execute("PRAGMA table_info(prereg)")
+    if 'place' not in [col[1] for col in await cur.fetchall()]:
+        await db.execute("ALTER TABLE prereg ADD COLUMN place INTEGER")
+        await db.execute("""
+            WITH ranked AS (
+                SELECT user_id, ROW_NUMBER() OVER (ORDER BY created_at, user_id) AS rn FROM prereg
+            )
+            UPDATE prereg SET place = (SELECT rn FROM ranked WHERE ranked.user_id = prereg.user_id)
+        """)
+    await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_prereg_place ON prereg(place)")
+
+async def _events_indexes(db):
+    """Индексы для выборок событий по пользователю и по типу"""
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_events_user_ts ON events(user_id, ts)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_events_event ON events(event)")
+
+async def _reminders(db):
+    """Таблица запланированных напоминаний (одно на пользователя)"""
+    await db.execute("""CREATE TABLE IF NOT EXISTS reminders(
+        user_id INTEGER PRIMARY KEY,
+        due_at REAL, created_at REAL
+    )""")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_reminders_due_at ON reminders(due_at)")
+
+async def _fsm_sessions(db):
+    """Состояния FSM (незаконченные анкеты) для хранилища SQLiteStorage"""
+    await db.execute("""CREATE TABLE IF NOT EXISTS fsm_sessions(
+        key TEXT PRIMARY KEY,
+        state TEXT, data TEXT, updated_at REAL
+    )""")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_fsm_sessions_updated_at ON fsm_sessions(updated_at)")
+
+async def _lead_stats(db):
+    """Счётчики лидов по дням для /stats, заполненные по outbox"""
+    await db.execute("""CREATE TABLE IF NOT EXISTS lead_stats_daily(
+        day TEXT PRIMARY KEY,
+        leads INTEGER NOT NULL
+    )""")
+    # День — дата TG Complete (пятое поле строки для таблицы)
+    await db.execute("""
+        INSERT OR REPLACE INTO lead_stats_daily(day, leads)
+        SELECT substr(json_extract(row_json, '$[4]'), 1, 10) AS day, COUNT(*)
+        FROM lead_outbox WHERE day IS NOT NULL AND day != '' GROUP BY day
+    """)
+
+async def _leads(db):
+    """Локальная копия лидов для /leads и /resend, заполненная по outbox"""
+    await db.execute("""CREATE TABLE IF NOT EXISTS leads(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        lead_id TEXT UNIQUE, user_id INTEGER, username TEXT,
+        completed_at TEXT, day TEXT, utm_source TEXT,
+        row_json TEXT, data_json TEXT
+    )""")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_leads_utm_source ON leads(utm_source, id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_leads_day ON leads(day, id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_leads_day_utm_source ON leads(day, utm_source, id)")
+    # Строка таблицы: Lead ID, User ID, Username, TG Start, TG Complete, ответы..., 5 UTM (первый — utm_source)
+    await db.execute("""
+        INSERT OR IGNORE INTO leads(lead_id, user_id, username, completed_at, day, utm_source, row_json)
+        SELECT lead_id, user_id,
+               json_extract(row_json, '$[2]'),
+               json_extract(row_json, '$[4]'),
+               substr(json_extract(row_json, '$[4]'), 1, 10),
+               NULLIF(json_extract(row_json, '$[' || (json_array_length(row_json) - 5) || ']'), ''),
+               row_json
+        FROM lead_outbox ORDER BY id
+    """)
+
+async def _utm_funnel(db):
+    """UTM-метки лида в таблице leads и rollup-таблицы воронки по UTM"""
+    cur = await db.execute("PRAGMA table_info(leads)")
+    columns = [col[1] for col in await cur.fetchall()]
+    for column in ('utm_medium', 'utm_campaign'):
+        if column not in columns:
+            await db.execute(f"ALTER TABLE leads ADD COLUMN {column} TEXT")
+    # UTM Medium и UTM Campaign — 4-й и 3-й с конца столбцы строки таблицы
+    await db.execute("""
+        UPDATE leads SET
+            utm_medium = NULLIF(COALESCE(json_extract(data_json, '$.utm_data.utm_medium'),
+                json_extract(row_json, '$[' || (json_array_length(row_json) - 4) || ']')), ''),
+            utm_campaign = NULLIF(COALESCE(json_extract(data_json, '$.utm_data.utm_campaign'),
+                json_extract(row_json, '$[' || (json_array_length(row_json) - 3) || ']')), '')
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_leads_utm ON leads(utm_source, utm_medium, utm_campaign, id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_leads_utm_campaign ON leads(utm_campaign, id)")
+
+    # Пустая строка вместо NULL: NULL в первичном ключе не совпадает сам с собой
+    await db.execute("""CREATE TABLE IF NOT EXISTS utm_funnel_daily(
+        day TEXT, utm_source TEXT, utm_medium TEXT, utm_campaign TEXT,
+        starts INTEGER NOT NULL, completes INTEGER NOT NULL,
+        PRIMARY KEY (day, utm_source, utm_medium, utm_campaign)
+    )""")
+    await db.execute("""CREATE TABLE IF NOT EXISTS utm_answers_daily(
+        day TEXT, utm_source TEXT, utm_medium TEXT, utm_campaign TEXT,
+        question_id TEXT, answer TEXT, leads INTEGER NOT NULL,
+        PRIMARY KEY (day, utm_source, utm_medium, utm_campaign, question_id, answer)
+    )""")
+
+async def _survey_steps(db):
+    """Показы, ответы и скетч времени на вопрос по дням (шаги анкеты)"""
+    await db.execute("""CREATE TABLE IF NOT EXISTS survey_step_daily(
+        day TEXT, question_id TEXT,
+        reached INTEGER NOT NULL, answered INTEGER NOT NULL,
+        dwell_sketch TEXT,
+        PRIMARY KEY (day, question_id)
+    )""")
+
+# Порядок важен: номер версии = позиция в списке
+MIGRATIONS = [
+    _initial_schema,
+    _prereg_place,
+    _events_indexes,
+    _reminders,
+    _fsm_sessions,
+    _lead_stats,
+    _leads,
+    _utm_funnel,
+    _survey_steps,
+]
+
+async def apply_migrations(database) -> int:
+    """Применяет недостающие миграции и возвращает текущую версию схемы"""
+    cur = await database.conn.execute("PRAGMA user_version")
+    current = (await cur.fetchone())[0]
+
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if version <= current:
+            continue
+        async with database.transaction() as db:
+            # DDL в sqlite3 не открывает транзакцию неявно — начинаем её явно
+            await db.execute("BEGIN")
+            await migration(db)
+            await db.execute(f"PRAGMA user_version = {version}")
+        logger.info(f"Применена миграция базы данных {version}: {migration.__doc__}")
+        current = version
+
+    return current
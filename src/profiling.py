@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Поиск медленных апдейтов: замер каждого апдейта и сохранение профилей
+"""
+
+import asyncio
+import cProfile
+import linecache
+import logging
+import os
+import random
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from aiogram import BaseMiddleware
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Сведения о текущем апдейте; inner middleware дописывает имя обработчика
+_current_trace: ContextVar[Optional[Dict[str, Any]]] = ContextVar('update_trace', default=None)
+
+def format_await_chain(coro) -> List[str]:
+    """Цепочка await от корутины задачи до объекта, которого она ждёт (как в traceback)"""
+    lines = []
+    while coro is not None:
+        frame = getattr(coro, 'cr_frame', None) or getattr(coro, 'gi_frame', None) or getattr(coro, 'ag_frame', None)
+        if frame is None and not hasattr(coro, 'cr_await') and not hasattr(coro, 'gi_yieldfrom'):
+            # Дошли до Future/Task или другого awaitable
+            lines.append(f"  awaiting {coro!r}")
+            break
+        if frame is not None:
+            code = frame.f_code
+            lines.append(f'  File "{code.co_filename}", line {frame.f_lineno}, in {code.co_name}')
+            source = linecache.getline(code.co_filename, frame.f_lineno).strip()
+            if source:
+                lines.append(f"    {source}")
+        coro = getattr(coro, 'cr_await', None) or getattr(coro, 'gi_yieldfrom', None) or getattr(coro, 'ag_await', None)
+    return lines
+
+class _HandlerNameMiddleware(BaseMiddleware):
+    """Inner middleware: сообщает профилировщику, какой обработчик выбран для апдейта"""
+
+    async def __call__(self, handler, event, data):
+        trace = _current_trace.get()
+        if trace is not None:
+            handler_object = data.get('handler')
+            trace['handler'] = getattr(getattr(handler_object, 'callback', None), '__name__', 'unknown')
+        return await handler(event, data)
+
+class SlowUpdateProfiler(BaseMiddleware):
+    """Outer middleware диспетчера: замеряет каждый апдейт и сохраняет профили медленных.
+
+    Если апдейт обрабатывается дольше threshold, в момент превышения снимается
+    стек задачи asyncio — видно, на каком await он завис. Доля sample_rate
+    апдейтов целиком профилируется cProfile (только когда другой профиль не
+    снимается: профилировщик в потоке один). Файлы пишутся в directory,
+    хранятся последние max_files.
+    """
+
+    def __init__(self, threshold: float = None, sample_rate: float = None,
+                 directory: str = None, max_files: int = None):
+        self.threshold = threshold or Config.PROFILE_SLOW_THRESHOLD
+        self.sample_rate = Config.PROFILE_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.directory = directory or Config.PROFILE_DIR
+        self.max_files = max_files or Config.PROFILE_MAX_FILES
+        self._profiling = False
+
+    def setup(self, dispatcher):
+        """Регистрирует профилировщик на всех апдейтах и определение имени обработчика"""
+        dispatcher.update.outer_middleware(self)
+        dispatcher.message.middleware(_HandlerNameMiddleware())
+        dispatcher.callback_query.middleware(_HandlerNameMiddleware())
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        trace = {
+            'update_id': getattr(event, 'update_id', 0),
+            'user_id': user.id if user else None,
+            'handler': 'unhandled',
+        }
+        token = _current_trace.set(trace)
+
+        # Стек задачи снимается, пока апдейт ещё выполняется
+        task = asyncio.current_task()
+        watchdog = asyncio.get_running_loop().call_later(self.threshold, self._capture_stack, task, trace)
+
+        profile = None
+        if self.sample_rate and not self._profiling and random.random() < self.sample_rate:
+            profile = cProfile.Profile()
+            self._profiling = True
+            profile.enable()
+
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            duration = time.perf_counter() - started
+            watchdog.cancel()
+            _current_trace.reset(token)
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+                self._save_profile(profile, trace, duration)
+
+            if duration >= self.threshold:
+                logger.warning(
+                    f"Медленный апдейт id={trace['update_id']}: {duration * 1000:.0f} мс, "
+                    f"обработчик {trace['handler']}, пользователь {trace['user_id']}"
+                )
+
+    def _capture_stack(self, task: Optional[asyncio.Task], trace: Dict[str, Any]):
+        if task is None or task.done():
+            return
+        try:
+            path = self._path(trace, 'stack.txt')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(f"update_id={trace['update_id']} user_id={trace['user_id']} "
+                        f"handler={trace['handler']} threshold={self.threshold}s\n\n")
+                f.write("Await chain (most recent call last):\n")
+                f.write('\n'.join(format_await_chain(task.get_coro())) + '\n')
+            logger.warning(f"Апдейт id={trace['update_id']} выполняется дольше {self.threshold} с, стек: {path}")
+            self._rotate()
+        except OSError as e:
+            logger.error(f"Не удалось сохранить стек апдейта: {e}")
+
+    def _save_profile(self, profile: cProfile.Profile, trace: Dict[str, Any], duration: float):
+        try:
+            path = self._path(trace, f"{duration * 1000:.0f}ms.prof")
+            profile.dump_stats(path)
+            self._rotate()
+        except OSError as e:
+            logger.error(f"Не удалось сохранить профиль апдейта: {e}")
+
+    def _path(self, trace: Dict[str, Any], suffix: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}_{trace['update_id']}_{trace['handler']}_{suffix}"
+        return os.path.join(self.directory, name)
+
+    def _rotate(self):
+        """Удаляет самые старые файлы сверх max_files"""
+        files = [os.path.join(self.directory, name) for name in os.listdir(self.directory)]
+        if len(files) <= self.max_files:
+            return
+        files.sort(key=os.path.getmtime)
+        for path in files[:len(files) - self.max_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
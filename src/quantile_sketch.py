@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Потоковая оценка квантилей (DDSketch) без хранения всех значений
+
+Значение попадает в логарифмическую корзину: для корзины k это интервал
+(gamma^(k-1), gamma^k], gamma = (1 + a) / (1 - a). Оценка любого квантиля
+отличается от точного значения не больше чем на долю a. Скетчи с одинаковой
+точностью складываются (merge), поэтому их можно хранить по дням и
+объединять за любой период.
+"""
+
+import math
+from typing import Any, Dict
+
+# Значения не больше MIN_VALUE считаются нулём (отдельный счётчик)
+MIN_VALUE = 1e-3
+
+class DDSketch:
+    """Скетч квантилей с относительной погрешностью relative_accuracy"""
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 2048):
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        """Добавляет одно значение"""
+        if value <= MIN_VALUE:
+            self.zero_count += 1
+        else:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[key] = self.bins.get(key, 0) + 1
+            if len(self.bins) > self.max_buckets:
+                self._collapse()
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: 'DDSketch'):
+        """Добавляет значения другого скетча той же точности"""
+        if other.gamma != self.gamma:
+            raise ValueError("Скетчи с разной точностью нельзя объединить")
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        if len(self.bins) > self.max_buckets:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля q (0..1); для пустого скетча — nan"""
+        if not self.count:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return max(self.min, 0.0)
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if rank < seen:
+                # Середина корзины в относительной мере: погрешность не больше relative_accuracy
+                estimate = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def _collapse(self):
+        """Сливает младшие корзины: точность сохраняется для верхних квантилей"""
+        keys = sorted(self.bins)
+        excess = len(keys) - self.max_buckets
+        target = keys[excess]
+        self.bins[target] += sum(self.bins.pop(key) for key in keys[:excess])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'a': self.relative_accuracy, 'z': self.zero_count, 'n': self.count,
+            'min': self.min if self.count else None, 'max': self.max if self.count else None,
+            'b': sorted(self.bins.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'DDSketch':
+        sketch = cls(data['a'])
+        sketch.bins = {int(key): count for key, count in data['b']}
+        sketch.zero_count = data['z']
+        sketch.count = data['n']
+        if sketch.count:
+            sketch.min, sketch.max = data['min'], data['max']
+        return sketch
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Ограничение скорости исходящих сообщений с учётом лимитов Telegram
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    CopyMessage, EditMessageReplyMarkup, EditMessageText, ForwardMessage,
+    SendDocument, SendMessage, SendPhoto,
+)
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше — важнее
+PRIORITY_INTERACTIVE = 0   # ответы пользователю в рамках апдейта
+PRIORITY_BULK = 1          # напоминания, уведомления канала, рассылки
+
+# Методы, на которые распространяются лимиты отправки сообщений
+LIMITED_METHODS = (
+    SendMessage, SendPhoto, SendDocument, CopyMessage, ForwardMessage,
+    EditMessageText, EditMessageReplyMarkup,
+)
+
+# Правка существующего сообщения не создаёт новое и не ждёт очереди чата
+EDIT_METHODS = (EditMessageText, EditMessageReplyMarkup)
+
+send_priority: ContextVar[int] = ContextVar('send_priority', default=PRIORITY_INTERACTIVE)
+
+@contextmanager
+def low_priority():
+    """Помечает отправки внутри блока как фоновые — они уступают ответам пользователям"""
+    token = send_priority.set(PRIORITY_BULK)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+def _is_group(chat_id) -> bool:
+    """Отрицательный chat_id или @username — группа или канал"""
+    return not isinstance(chat_id, int) or chat_id < 0
+
+class _TokenBucket:
+    """Простой token bucket: rate токенов в секунду, не больше burst"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated', 'paused_until')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        """Резервирует токен и возвращает, сколько секунд ждать до его появления"""
+        self.refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def take(self, now: float) -> float:
+        """Расходует токен без ожидания очереди; ждать нужно только паузу после RetryAfter"""
+        self.refill(now)
+        if self.tokens > 0:
+            self.tokens = max(self.tokens - 1, 0.0)
+        return max(self.paused_until - now, 0.0)
+
+class TelegramRateLimiter(BaseRequestMiddleware):
+    """Request middleware сессии бота: общая очередь исходящих сообщений.
+
+    Все отправки (в том числе message.answer в обработчиках) проходят через
+    глобальный token bucket (~30 сообщений/с). Bucket на каждый чат (~1/с для
+    личных чатов, медленнее для групп и каналов) ограничивает фоновые рассылки
+    и сообщения в группы; ответы пользователю в личном чате и правки сообщений
+    его не ждут, а только расходуют токены, чтобы рассылка шла после них.
+    Глобальные токены выдаются по приоритету, поэтому фоновые рассылки
+    уступают интерактивным ответам.
+    При TelegramRetryAfter чат ставится на паузу и запрос повторяется.
+    """
+
+    def __init__(self, global_rate: float = None, chat_rate: float = None, chat_burst: float = None,
+                 group_rate: float = None, group_burst: float = None, max_retries: int = 3):
+        self.global_rate = global_rate or Config.TG_GLOBAL_RATE
+        self.chat_rate = chat_rate or Config.TG_CHAT_RATE
+        self.chat_burst = chat_burst or Config.TG_CHAT_BURST
+        self.group_rate = group_rate or Config.TG_GROUP_RATE
+        self.group_burst = group_burst or Config.TG_GROUP_BURST
+        self.max_retries = max_retries
+
+        self._global_tokens = float(self.global_rate)
+        self._global_updated = time.monotonic()
+        self._chats: Dict[int, _TokenBucket] = {}
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    def split(self, count: int):
+        """Делит общие лимиты между count процессами-воркерами.
+
+        Лимиты личных чатов не делятся: пользователь всегда обслуживается одним воркером.
+        """
+        self.global_rate /= count
+        self._global_tokens = min(self._global_tokens, float(self.global_rate))
+        self.group_rate /= count
+        self.group_burst = max(self.group_burst / count, 1)
+
+    @property
+    def queue_depth(self) -> int:
+        """Количество сообщений, ожидающих глобального токена"""
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def __call__(self, make_request, bot, method):
+        if not isinstance(method, LIMITED_METHODS):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, 'chat_id', None)
+        priority = send_priority.get()
+        # Темп чата выдерживают фоновые отправки и новые сообщения в группы и каналы
+        paced = not isinstance(method, EDIT_METHODS) and (priority != PRIORITY_INTERACTIVE or _is_group(chat_id))
+
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, priority, paced)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning(f"Flood control в чате {chat_id}: повтор через {e.retry_after} с")
+                self._pause_chat(chat_id, e.retry_after)
+
+    async def _acquire(self, chat_id, priority: int, paced: bool = True):
+        """Ждёт токен чата (или только паузу чата, если paced=False), затем глобальный токен по приоритету"""
+        if chat_id is not None:
+            bucket = self._chat_bucket(chat_id)
+            now = time.monotonic()
+            delay = bucket.reserve(now) if paced else bucket.take(now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        """Выдаёт глобальные токены ожидающим, начиная с самого приоритетного"""
+        while self._waiters:
+            now = time.monotonic()
+            self._global_tokens = min(
+                float(self.global_rate),
+                self._global_tokens + (now - self._global_updated) * self.global_rate
+            )
+            self._global_updated = now
+
+            while self._waiters and self._global_tokens >= 1:
+                _, _, future = heapq.heappop(self._waiters)
+                if future.done():  # ожидающий отменён
+                    continue
+                future.set_result(None)
+                self._global_tokens -= 1
+
+            if self._waiters:
+                await asyncio.sleep((1 - self._global_tokens) / self.global_rate)
+
+        self._prune_chats()
+
+    def _chat_bucket(self, chat_id) -> _TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = (_TokenBucket(self.group_rate, self.group_burst) if _is_group(chat_id)
+                      else _TokenBucket(self.chat_rate, self.chat_burst))
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _pause_chat(self, chat_id, seconds: float):
+        """Запрещает отправку в чат на seconds секунд (по ответу RetryAfter)"""
+        bucket = self._chat_bucket(chat_id)
+        now = time.monotonic()
+        bucket.refill(now)
+        bucket.tokens = min(bucket.tokens, 0) - seconds * bucket.rate
+        bucket.paused_until = max(bucket.paused_until, now + seconds)
+
+    def _prune_chats(self):
+        """Удаляет полностью восстановившиеся bucket'ы неактивных чатов"""
+        if len(self._chats) < 10000:
+            return
+        now = time.monotonic()
+        for chat_id in list(self._chats):
+            bucket = self._chats[chat_id]
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self._chats[chat_id]
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Планировщик напоминаний с хранением в таблице reminders
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class ReminderScheduler:
+    """Один таймер на все напоминания вместо отдельной спящей задачи на пользователя.
+
+    Напоминания хранятся в bot.db (по одному на пользователя), поэтому переживают
+    перезапуск. Цикл спит до ближайшего due_at (индексированный запрос),
+    затем отправляет наступившие напоминания пачками и удаляет их.
+    """
+
+    def __init__(self, database, send: Callable[[int], Awaitable[None]], batch_size: int = None):
+        self.database = database
+        self.send = send
+        self.batch_size = batch_size or Config.REMINDERS_BATCH_SIZE
+
+        # В режиме шардирования каждый воркер отправляет напоминания только своим пользователям
+        self.shard_index = 0
+        self.shard_count = 1
+
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    async def start(self):
+        """Запускает цикл отправки напоминаний"""
+        # Event создаём внутри работающего loop (в Python 3.9 он привязывается к loop при создании)
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+        pending = await self.pending_count()
+        if pending:
+            logger.info(f"Загружено запланированных напоминаний: {pending}")
+
+    async def stop(self):
+        """Останавливает цикл. Неотправленные напоминания остаются в базе"""
+        if self._task:
+            # Не отменяем задачу посреди _send_due: пачка, уже отправленная, но ещё
+            # не удалённая из reminders, ушла бы повторно после перезапуска
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+
+    async def schedule(self, user_id: int, delay_seconds: float):
+        """Планирует напоминание, заменяя предыдущее напоминание пользователя"""
+        async with self.database.transaction() as db:
+            await db.execute("""
+                INSERT INTO reminders(user_id, due_at, created_at) VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET due_at=excluded.due_at, created_at=excluded.created_at
+            """, (user_id, time.time() + delay_seconds, time.time()))
+        # Новое напоминание может оказаться раньше того, до которого спит цикл
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def pending_count(self) -> int:
+        """Количество запланированных напоминаний"""
+        cur = await self.database.conn.execute("SELECT COUNT(*) FROM reminders")
+        return (await cur.fetchone())[0]
+
+    async def _run(self):
+        """Цикл: ждём ближайшее напоминание или новое планирование, отправляем наступившие"""
+        while not self._stopping:
+            try:
+                # Сбрасываем до запроса: schedule() во время SELECT снова выставит
+                # флаг, и цикл перечитает MIN(due_at) вместо сна до старого срока
+                self._wakeup.clear()
+                cur = await self.database.conn.execute(
+                    "SELECT MIN(due_at) FROM reminders WHERE ABS(user_id) % ? = ?",
+                    (self.shard_count, self.shard_index)
+                )
+                next_due = (await cur.fetchone())[0]
+                timeout = None if next_due is None else max(next_due - time.time(), 0)
+
+                if timeout is None or timeout > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                        continue
+                    except asyncio.TimeoutError:
+                        pass
+
+                await self._send_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка в планировщике напоминаний: {e}")
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _send_due(self):
+        """Отправляет наступившие напоминания пачками по batch_size"""
+        while not self._stopping:
+            now = time.time()
+            cur = await self.database.conn.execute(
+                "SELECT user_id, due_at FROM reminders WHERE due_at <= ? AND ABS(user_id) % ? = ? "
+                "ORDER BY due_at LIMIT ?",
+                (now, self.shard_count, self.shard_index, self.batch_size)
+            )
+            due = await cur.fetchall()
+            if not due:
+                return
+
+            await asyncio.gather(*(self.send(user_id) for user_id, _ in due), return_exceptions=True)
+
+            # Удаляем только отправленные версии: перепланированные за это время остаются
+            async with self.database.transaction() as db:
+                await db.executemany("DELETE FROM reminders WHERE user_id=? AND due_at=?", due)
+            logger.info(f"Отправлено напоминаний: {len(due)}")
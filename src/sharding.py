@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Шардирование апдейтов по user_id между несколькими процессами-воркерами
+
+Супервизор получает апдейты (polling или webhook) и отправляет сырой JSON
+в процесс-воркер, выбранный по from_user.id. Апдейты одного пользователя
+всегда попадают в один воркер и обрабатываются там по порядку, а общее
+состояние (предзаписи, события, напоминания, outbox) хранится в bot.db.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue as queue_module
+import signal
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def shard_of(user_id: int, count: int) -> int:
+    """Номер шарда пользователя. Та же формула используется в SQL: ABS(user_id) % count"""
+    return abs(int(user_id)) % count
+
+def update_user_id(raw: Dict[str, Any]) -> int:
+    """Извлекает id пользователя (или чата) из сырого апдейта для маршрутизации"""
+    for key, event in raw.items():
+        if key == 'update_id' or not isinstance(event, dict):
+            continue
+        user = event.get('from') or event.get('user')
+        if isinstance(user, dict) and 'id' in user:
+            return user['id']
+        chat = event.get('chat') or (event.get('message') or {}).get('chat')
+        if isinstance(chat, dict) and 'id' in chat:
+            return chat['id']
+    return 0
+
+class ShardSupervisor:
+    """Запускает N процессов-воркеров и раздаёт им апдейты по user_id.
+
+    Сторожевая задача раз в check_interval проверяет процессы: завершившийся
+    воркер перезапускается, а апдейты из его очереди переносятся в новую
+    (теряется только апдейт, который воркер обрабатывал в момент падения).
+    Если воркер падает чаще max_restarts раз за restart_window, супервизор
+    посылает себе SIGTERM и бот останавливается штатно.
+    """
+
+    def __init__(self, count: int, target: Callable[[int, int, Any], None],
+                 check_interval: float = None, max_restarts: int = None, restart_window: float = None):
+        self.count = count
+        self.target = target
+        self.check_interval = check_interval or Config.WORKER_CHECK_INTERVAL
+        self.max_restarts = Config.WORKER_MAX_RESTARTS if max_restarts is None else max_restarts
+        self.restart_window = restart_window or Config.WORKER_RESTART_WINDOW
+        self._ctx = multiprocessing.get_context('spawn')
+        self._queues: List[Any] = []
+        self._processes: List[Any] = []
+        self._restarts: List[Deque[float]] = []
+        self._watchdog: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Запускает процессы-воркеры и сторожевую задачу"""
+        for index in range(self.count):
+            queue = self._ctx.Queue()
+            self._queues.append(queue)
+            self._processes.append(self._spawn(index, queue))
+            self._restarts.append(deque())
+        self._watchdog = asyncio.create_task(self._watch())
+        logger.info(f"Запущено процессов-воркеров: {self.count}")
+
+    def _spawn(self, index: int, queue):
+        process = self._ctx.Process(
+            target=self.target, args=(index, self.count, queue),
+            name=f"bot-worker-{index}", daemon=False
+        )
+        process.start()
+        return process
+
+    async def _watch(self):
+        """Проверяет воркеры и перезапускает завершившиеся"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.check_interval)
+            for index, process in enumerate(self._processes):
+                if process.is_alive():
+                    continue
+                logger.error(f"Воркер {process.name} неожиданно завершился (exitcode {process.exitcode})")
+
+                now = time.monotonic()
+                restarts = self._restarts[index]
+                while restarts and restarts[0] < now - self.restart_window:
+                    restarts.popleft()
+                if len(restarts) >= self.max_restarts:
+                    logger.critical(
+                        f"Воркер {process.name} упал больше {self.max_restarts} раз за "
+                        f"{self.restart_window:.0f} с, останавливаем бота"
+                    )
+                    os.kill(os.getpid(), signal.SIGTERM)
+                    return
+                restarts.append(now)
+
+                # Новая очередь: упавший процесс мог оставить захваченной блокировку чтения старой
+                queue = self._ctx.Queue()
+                old_queue, self._queues[index] = self._queues[index], queue
+                moved = await loop.run_in_executor(None, self._move_updates, old_queue, queue)
+                self._processes[index] = self._spawn(index, queue)
+                logger.info(f"Воркер {process.name} перезапущен, перенесено апдейтов: {moved}")
+
+    @staticmethod
+    def _move_updates(old_queue, queue) -> int:
+        """Переносит апдейты из очереди упавшего воркера в новую"""
+        moved = 0
+        while True:
+            try:
+                raw = old_queue.get(timeout=0.1)
+            except queue_module.Empty:
+                break
+            if raw is not None:
+                queue.put(raw)
+                moved += 1
+        # Не ждём при выходе записи в канал, который больше никто не читает
+        old_queue.cancel_join_thread()
+        old_queue.close()
+        return moved
+
+    def route(self, raw: Dict[str, Any]):
+        """Отправляет сырой апдейт в воркер, отвечающий за пользователя"""
+        self._queues[shard_of(update_user_id(raw), self.count)].put(raw)
+
+    async def stop(self, timeout: float = 30):
+        """Просит воркеры доработать очереди и дожидается их завершения"""
+        if self._watchdog:
+            self._watchdog.cancel()
+            try:
+                await self._watchdog
+            except asyncio.CancelledError:
+                pass
+            self._watchdog = None
+        for queue in self._queues:
+            queue.put(None)
+        loop = asyncio.get_running_loop()
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.warning(f"Воркер {process.name} не завершился за {timeout} с, останавливаем")
+                process.kill()
+        logger.info("Процессы-воркеры остановлены")
+
+def stop_signal_event() -> asyncio.Event:
+    """Event, который выставляется по SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # Windows
+            pass
+    return stop_event
+
+def ignore_stop_signals():
+    """Воркер игнорирует SIGINT/SIGTERM: остановкой управляет супервизор через очередь"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+async def poll_updates(bot, route: Callable[[Dict[str, Any]], None], allowed_updates: List[str],
+                       timeout: int = 30):
+    """Long polling в супервизоре: получает апдейты и раздаёт их воркерам"""
+    offset: Optional[int] = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка получения апдейтов: {e}")
+            await asyncio.sleep(1)
+            continue
+
+        for update in updates:
+            route(update.model_dump(mode='json', by_alias=True, exclude_none=True))
+            offset = update.update_id + 1
+
+class OrderedUpdateFeeder:
+    """Воркер: обрабатывает апдейты параллельно, но строго по порядку для каждого пользователя"""
+
+    def __init__(self, dispatcher, bot):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self._tails: Dict[int, asyncio.Task] = {}
+
+    def feed(self, raw: Dict[str, Any]):
+        user_id = update_user_id(raw)
+        previous = self._tails.get(user_id)
+        task = asyncio.create_task(self._process(previous, raw))
+        self._tails[user_id] = task
+        task.add_done_callback(lambda t: self._tails.pop(user_id, None) if self._tails.get(user_id) is t else None)
+
+    async def _process(self, previous: Optional[asyncio.Task], raw: Dict[str, Any]):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await self.dispatcher.feed_raw_update(self.bot, raw)
+        except Exception as e:
+            logger.error(f"Ошибка обработки апдейта {raw.get('update_id')}: {e}")
+
+    async def run(self, queue):
+        """Читает апдейты из очереди супервизора до сигнала остановки (None)"""
+        loop = asyncio.get_running_loop()
+        while True:
+            raw = await loop.run_in_executor(None, queue.get)
+            if raw is None:
+                break
+            self.feed(raw)
+
+        pending = list(self._tails.values())
+        if pending:
+            logger.info(f"Дожидаемся обработки апдейтов: {len(pending)}")
+            await asyncio.wait(pending)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Граф анкеты: индекс вопросов по id и условия пропуска вопросов
+
+Ответы хранятся в FSM компактно: для одиночного выбора — индекс варианта,
+для множественного — битовая маска (бит i — выбран вариант i). В текст
+они превращаются только при выгрузке лида и отправке уведомления.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class SurveyNode:
+    """Вопрос анкеты в скомпилированном графе"""
+
+    __slots__ = ('id', 'index', 'question', 'options', 'is_multi', 'skip_if', 'next')
+
+    def __init__(self, index: int, question: Dict[str, Any], skip_if: Dict[str, int]):
+        self.id = question['id']
+        self.index = index
+        self.question = question
+        self.options: List[str] = question['options']
+        self.is_multi = question['type'] == 'multi'
+        # id предыдущего вопроса -> маска вариантов, при которых этот вопрос пропускается
+        self.skip_if = skip_if
+        self.next: Optional['SurveyNode'] = None
+
+    def mask(self, answer: Any) -> int:
+        """Битовая маска ответа (для одиночного выбора — маска из одного бита)"""
+        if isinstance(answer, int):
+            return answer if self.is_multi else 1 << answer
+        # Сессии, начатые до перехода на индексы, хранят текст вариантов
+        selected = answer if isinstance(answer, list) else [answer]
+        return sum(1 << i for i, option in enumerate(self.options) if option in selected)
+
+    def decode(self, answer: Any) -> str:
+        """Текст ответа для выгрузки и уведомлений"""
+        if answer is None:
+            return 'Не указано'
+        if isinstance(answer, int):
+            if not self.is_multi:
+                return self.options[answer] if 0 <= answer < len(self.options) else 'Не указано'
+            answer = [option for i, option in enumerate(self.options) if answer >> i & 1]
+        if isinstance(answer, list):
+            return ', '.join(answer) if answer else 'Не указано'
+        return answer
+
+class SurveyGraph:
+    """SURVEY_CONFIG, скомпилированный в связанный список вопросов с индексом по id.
+
+    Условия пропуска задаются в вопросе ключом skip_if:
+    {"work_type": ["На склад МП (FBO/FBW)"]} — вопрос не задаётся, если на
+    вопрос work_type выбран один из перечисленных вариантов. Условия могут
+    ссылаться только на предыдущие вопросы и проверяются при компиляции.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.nodes: List[SurveyNode] = []
+        self._by_id: Dict[str, SurveyNode] = {}
+
+        for index, question in enumerate(config['questions']):
+            if question['id'] in self._by_id:
+                raise ValueError(f"Повторяющийся id вопроса: {question['id']}")
+
+            skip_if = {}
+            for question_id, values in question.get('skip_if', {}).items():
+                source = self._by_id.get(question_id)
+                if source is None:
+                    raise ValueError(f"Вопрос {question['id']}: skip_if ссылается не на предыдущий вопрос {question_id}")
+                unknown = set(values) - set(source.options)
+                if unknown:
+                    raise ValueError(f"Вопрос {question['id']}: в skip_if неизвестные варианты {question_id}: {unknown}")
+                skip_if[question_id] = source.mask(list(values))
+
+            node = SurveyNode(index, question, skip_if)
+            if self.nodes:
+                self.nodes[-1].next = node
+            self.nodes.append(node)
+            self._by_id[node.id] = node
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def get(self, question_id: str) -> Optional[SurveyNode]:
+        """Вопрос по id"""
+        return self._by_id.get(question_id)
+
+    def next_after(self, question_id: str, answers: Dict[str, Any]) -> Optional[SurveyNode]:
+        """Следующий вопрос с учётом условий пропуска; None — анкета завершена"""
+        node = self._by_id.get(question_id)
+        node = node.next if node else None
+        while node is not None and self._is_skipped(node, answers):
+            node = node.next
+        return node
+
+    def _is_skipped(self, node: SurveyNode, answers: Dict[str, Any]) -> bool:
+        """Вопрос пропускается, если ответ на один из предыдущих вопросов попал в skip_if"""
+        for question_id, skip_mask in node.skip_if.items():
+            answer = answers.get(question_id)
+            if answer is not None and self._by_id[question_id].mask(answer) & skip_mask:
+                return True
+        return False
+
+    def decode_answers(self, answers: Dict[str, Any]) -> List[Tuple[SurveyNode, str]]:
+        """Ответы в порядке вопросов, расшифрованные в текст"""
+        return [(node, node.decode(answers.get(node.id))) for node in self.nodes]
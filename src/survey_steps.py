@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Шаги анкеты: сколько пользователей дошло до вопроса, ответило на него и
+сколько времени думало
+
+show_question и ответы пишут в EventBuffer лёгкие события (id вопроса и
+время). SurveyStepAggregator получает каждую пачку событий в транзакции
+её записи и обновляет survey_step_daily: счётчики показов и ответов и
+скетч квантилей времени на вопрос (DDSketch) по дню и вопросу. Отдельные
+замеры не хранятся.
+"""
+
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from config import Config
+from quantile_sketch import DDSketch
+
+logger = logging.getLogger(__name__)
+
+STEP_SHOWN = 'survey_step_shown'
+STEP_ANSWERED = 'survey_step_answered'
+
+def _timestamp(utc_iso: str) -> datetime:
+    return datetime.fromisoformat(utc_iso).replace(tzinfo=timezone.utc)
+
+class _DayStats:
+    __slots__ = ('reached', 'answered', 'dwell')
+
+    def __init__(self):
+        self.reached = 0
+        self.answered = 0
+        self.dwell = DDSketch()
+
+class SurveyStepAggregator:
+    """Агрегатор EventBuffer для событий шагов анкеты.
+
+    Время на вопрос — от показа вопроса до ответа того же пользователя. Время
+    показа хранится в памяти (пользователь → последний показанный вопрос);
+    записи старше timeout удаляются: пользователь, вернувшийся позже, считается
+    бросившим вопрос, а его ответ учитывается без замера времени.
+    """
+
+    def __init__(self, timeout: float = None):
+        self.timeout = timeout or Config.SURVEY_STEP_TIMEOUT
+        self._shown: 'OrderedDict[int, Tuple[str, datetime]]' = OrderedDict()
+
+    async def __call__(self, db, batch: Sequence[Tuple[int, str, str, str]]):
+        stats: Dict[Tuple[str, str], _DayStats] = {}
+        newest: Optional[datetime] = None
+        for user_id, event, question_id, ts in batch:
+            if event not in (STEP_SHOWN, STEP_ANSWERED):
+                continue
+            at = _timestamp(ts)
+            newest = at
+            key = (at.astimezone().strftime('%Y-%m-%d'), question_id)
+            day_stats = stats.get(key)
+            if day_stats is None:
+                day_stats = stats[key] = _DayStats()
+
+            if event == STEP_SHOWN:
+                day_stats.reached += 1
+                self._shown[user_id] = (question_id, at)
+                self._shown.move_to_end(user_id)
+            else:
+                day_stats.answered += 1
+                shown = self._shown.get(user_id)
+                if shown is not None and shown[0] == question_id:
+                    del self._shown[user_id]
+                    dwell = (at - shown[1]).total_seconds()
+                    if dwell <= self.timeout:
+                        day_stats.dwell.add(dwell)
+
+        if newest is not None:
+            self._expire(newest)
+        for (day, question_id), day_stats in stats.items():
+            await self._save(db, day, question_id, day_stats)
+
+    def _expire(self, now: datetime):
+        """Удаляет показы старше timeout (записи упорядочены по времени показа)"""
+        while self._shown:
+            user_id, (_, at) = next(iter(self._shown.items()))
+            if (now - at).total_seconds() <= self.timeout:
+                break
+            del self._shown[user_id]
+
+    @staticmethod
+    async def _save(db, day: str, question_id: str, day_stats: _DayStats):
+        # Сначала запись: транзакция берёт блокировку до чтения скетча,
+        # поэтому воркеры не перезапишут скетчи друг друга
+        await db.execute(
+            "INSERT INTO survey_step_daily(day, question_id, reached, answered, dwell_sketch) VALUES(?, ?, ?, ?, NULL) "
+            "ON CONFLICT(day, question_id) DO UPDATE SET "
+            "reached = reached + excluded.reached, answered = answered + excluded.answered",
+            (day, question_id, day_stats.reached, day_stats.answered)
+        )
+        if not day_stats.dwell.count:
+            return
+        cur = await db.execute(
+            "SELECT dwell_sketch FROM survey_step_daily WHERE day = ? AND question_id = ?", (day, question_id)
+        )
+        stored = (await cur.fetchone())[0]
+        sketch = day_stats.dwell
+        if stored:
+            sketch = DDSketch.from_dict(json.loads(stored))
+            sketch.merge(day_stats.dwell)
+        await db.execute(
+            "UPDATE survey_step_daily SET dwell_sketch = ? WHERE day = ? AND question_id = ?",
+            (json.dumps(sketch.to_dict()), day, question_id)
+        )
+
+class SurveyStepReport:
+    """Отсев и время на вопрос за период из survey_step_daily"""
+
+    def __init__(self, database):
+        self.database = database
+
+    async def steps(self, since: str = None, until: str = None,
+                    quantiles: Sequence[float] = (0.5, 0.9, 0.99)) -> List[Dict[str, Any]]:
+        """По вопросам, от самого частого: показы, ответы, отсев и квантили времени, с"""
+        conditions, params = [], []
+        if since:
+            conditions.append("day >= ?")
+            params.append(since)
+        if until:
+            conditions.append("day <= ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cur = await self.database.conn.execute(
+            f"SELECT question_id, reached, answered, dwell_sketch FROM survey_step_daily {where}", params
+        )
+
+        questions: Dict[str, Dict[str, Any]] = {}
+        for question_id, reached, answered, stored in await cur.fetchall():
+            item = questions.get(question_id)
+            if item is None:
+                item = questions[question_id] = {'question_id': question_id, 'reached': 0, 'answered': 0,
+                                                  'dwell': DDSketch()}
+            item['reached'] += reached
+            item['answered'] += answered
+            if stored:
+                item['dwell'].merge(DDSketch.from_dict(json.loads(stored)))
+
+        result = []
+        for item in sorted(questions.values(), key=lambda item: item['reached'], reverse=True):
+            dwell = item.pop('dwell')
+            dropped = max(item['reached'] - item['answered'], 0)
+            item['dropped'] = dropped
+            item['drop_rate'] = dropped / item['reached'] if item['reached'] else None
+            item['dwell_samples'] = dwell.count
+            item['dwell'] = {q: dwell.quantile(q) for q in quantiles} if dwell.count else {}
+            result.append(item)
+        return result
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Приём апдейтов через webhook (aiohttp) как альтернатива long polling
+"""
+
+import asyncio
+import logging
+import secrets
+import signal
+from typing import Any, Callable, Dict, Optional
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class DrainingRequestHandler(SimpleRequestHandler):
+    """Обработчик webhook, который при остановке дожидается уже принятых апдейтов.
+
+    В отличие от SimpleRequestHandler не закрывает сессию бота: после остановки
+    сервера ещё выгружаются лиды и отправляются уведомления, сессию закрывает main().
+    """
+
+    async def close(self) -> None:
+        tasks = set(self._background_feed_update_tasks)
+        if not tasks:
+            return
+        logger.info(f"Дожидаемся обработки принятых апдейтов: {len(tasks)}")
+        _, pending = await asyncio.wait(tasks, timeout=Config.WEBHOOK_DRAIN_TIMEOUT)
+        if pending:
+            logger.warning(f"Не успели обработать апдейтов до остановки: {len(pending)}")
+
+def routing_handler(route: Callable[[Dict[str, Any]], None]):
+    """Обработчик webhook для супервизора: проверяет секрет и передаёт сырой апдейт воркерам"""
+    async def handle(request: web.Request) -> web.Response:
+        if Config.WEBHOOK_SECRET and not secrets.compare_digest(
+            request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), Config.WEBHOOK_SECRET
+        ):
+            return web.Response(body='Unauthorized', status=401)
+        route(await request.json())
+        return web.json_response({})
+    return handle
+
+async def run_webhook(dispatcher, bot, route: Optional[Callable[[Dict[str, Any]], None]] = None):
+    """Запускает aiohttp-сервер webhook и работает до SIGTERM/SIGINT.
+
+    Если передан route, апдейты не обрабатываются в этом процессе,
+    а передаются воркерам (режим шардирования).
+    """
+    if not Config.WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET не настроен. Запросы к webhook не проверяются.")
+
+    app = web.Application()
+    if route is None:
+        handler = DrainingRequestHandler(dispatcher=dispatcher, bot=bot, secret_token=Config.WEBHOOK_SECRET)
+        handler.register(app, path=Config.WEBHOOK_PATH)
+        setup_application(app, dispatcher, bot=bot)
+    else:
+        app.router.add_route("POST", Config.WEBHOOK_PATH, routing_handler(route))
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, Config.WEBAPP_HOST, Config.WEBAPP_PORT)
+    await site.start()
+    logger.info(f"Webhook сервер слушает {Config.WEBAPP_HOST}:{Config.WEBAPP_PORT}{Config.WEBHOOK_PATH}")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    try:
+        await bot.set_webhook(
+            url=Config.WEBHOOK_URL.rstrip('/') + Config.WEBHOOK_PATH,
+            secret_token=Config.WEBHOOK_SECRET,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+        )
+        logger.info("Webhook зарегистрирован в Telegram")
+
+        await stop_event.wait()
+        logger.info("Получен сигнал остановки, завершаем приём апдейтов")
+    finally:
+        # Сначала закрывается порт, затем on_shutdown дожидается принятых апдейтов.
+        # Webhook не удаляем: при деплое его уже мог перехватить новый инстанс.
+        await runner.cleanup()
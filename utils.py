@@ -5,10 +5,9 @@ import logging
 import asyncio
 from datetime import datetime
 from typing import Dict, Any, Optional
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from config import Config
+from google_sheets_manager import SCOPES, build_sheets_service
 
 # Настройка логирования
 logging.basicConfig(
@@ -62,11 +61,12 @@ class GoogleSheetsManager:
     def _initialize_service(self):
         """Инициализирует Google Sheets API сервис"""
         try:
+            from google.oauth2.service_account import Credentials
             credentials = Credentials.from_service_account_file(
                 Config.GOOGLE_SHEETS_CREDENTIALS_FILE,
-                scopes=['https://www.googleapis.com/auth/spreadsheets']
+                scopes=SCOPES
             )
-            self.service = build('sheets', 'v4', credentials=credentials)
+            self.service = build_sheets_service(credentials)
             logger.info("Google Sheets API сервис инициализирован")
         except Exception as e:
             logger.error(f"Ошибка инициализации Google Sheets API: {e}")